@@ -54,6 +54,8 @@ gcloud run deploy ${SERVICE_NAME} \
   --gpu=1 \
   --gpu-type=nvidia-l4 \
   --no-gpu-zonal-redundancy \
+  --no-cpu-throttling \
+  --session-affinity \
   --concurrency 1 \
   --port 8080
 
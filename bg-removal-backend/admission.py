@@ -0,0 +1,188 @@
+"""
+Memory-Budget Admission Control for Background Removal
+Estimates each request's peak memory from its header-probed size, admits work while
+the in-flight total fits a budget, and queues the rest (FIFO) until a deadline.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# In-flight memory budget in MB (0 = derive from the container memory limit, -1 = off)
+ADMISSION_MEMORY_BUDGET_MB = float(os.environ.get('ADMISSION_MEMORY_BUDGET_MB', '0'))
+# Share of the container memory limit used as the budget when it is derived (rest: models, runtime)
+ADMISSION_MEMORY_FRACTION = float(os.environ.get('ADMISSION_MEMORY_FRACTION', '0.5'))
+# How long a queued request waits for budget (seconds), and how many may wait at once
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '30'))
+ADMISSION_MAX_QUEUED = int(os.environ.get('ADMISSION_MAX_QUEUED', '8'))
+
+# Peak working set per processed pixel, by pipeline (measured ~22-29 B/px end to end for
+# enterprise): RGB/alpha arrays, trimap, matte, RGBA composite + resized copy, PNG encode
+# and the output re-decode/convert
+PIPELINE_BYTES_PER_PIXEL = {
+    'enterprise': 28,
+    'premium_hd': 96,  # + float32 alpha engine buffers, decontamination and sharpening copies
+}
+# Per-pixel cost of decoding the upload at its (draft-reduced) decode size, and a fixed
+# allowance for one model's input/output tensors (counted once per model live at a time)
+DECODE_BYTES_PER_PIXEL = 4
+INFERENCE_OVERHEAD_BYTES = 256 * 1024 * 1024
+
+
+class AdmissionRejected(RuntimeError):
+    """No budget freed up before the deadline (or the wait queue is full)"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def container_memory_limit_bytes():
+    """cgroup v2 / v1 memory limit of this container, or None when unlimited/unknown"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < (1 << 60):
+            return int(value)
+    return None
+
+
+def default_budget_bytes():
+    """Configured budget, or a fraction of the container limit; None disables admission control"""
+    if ADMISSION_MEMORY_BUDGET_MB > 0:
+        return int(ADMISSION_MEMORY_BUDGET_MB * 1024 * 1024)
+    if ADMISSION_MEMORY_BUDGET_MB < 0:
+        return None
+    limit = container_memory_limit_bytes()
+    return int(limit * ADMISSION_MEMORY_FRACTION) if limit else None
+
+
+def estimate_request_bytes(decode_size, process_size, pipeline, concurrent_models=1):
+    """
+    Peak memory estimate for one request.
+
+    Args:
+        decode_size: (w, h) the upload decodes at (after any JPEG draft reduction)
+        process_size: (w, h) the pipeline runs at
+        pipeline: key of PIPELINE_BYTES_PER_PIXEL
+        concurrent_models: models whose tensors are live at once (2 when semantic inference
+            and matting run side by side on the stage graph)
+    """
+    decode_pixels = decode_size[0] * decode_size[1]
+    process_pixels = process_size[0] * process_size[1]
+    return (decode_pixels * DECODE_BYTES_PER_PIXEL
+            + process_pixels * PIPELINE_BYTES_PER_PIXEL[pipeline]
+            + INFERENCE_OVERHEAD_BYTES * concurrent_models)
+
+
+class _Ticket:
+    __slots__ = ('cost', 'admitted_at')
+
+    def __init__(self, cost):
+        self.cost = cost
+        self.admitted_at = None
+
+
+class MemoryAdmission:
+    """
+    FIFO admission against a byte budget. Only the head of the queue may be admitted, so a
+    large request isn't starved by a stream of small ones; a request larger than the whole
+    budget runs alone once nothing else is in flight.
+    """
+
+    def __init__(self, budget_bytes, queue_timeout=ADMISSION_QUEUE_TIMEOUT, max_queued=ADMISSION_MAX_QUEUED):
+        self.budget_bytes = budget_bytes
+        self.queue_timeout = queue_timeout
+        self.max_queued = max_queued
+        self._in_use = 0
+        self._in_flight = 0
+        self._waiting = deque()
+        self._cond = threading.Condition()
+        self._hold_seconds = deque(maxlen=50)
+        self._counters = {'admitted': 0, 'queued': 0, 'rejected_full': 0, 'rejected_timeout': 0}
+
+    @property
+    def enabled(self):
+        return self.budget_bytes is not None
+
+    def _fits(self, ticket):
+        return self._in_flight == 0 or self._in_use + ticket.cost <= self.budget_bytes
+
+    def retry_after(self):
+        """Seconds until budget is likely free: the recent mean hold time (at least 1s)"""
+        with self._cond:
+            mean = sum(self._hold_seconds) / len(self._hold_seconds) if self._hold_seconds else 5.0
+        return max(1, int(math.ceil(mean)))
+
+    def acquire(self, cost, timeout=None):
+        """Block until `cost` bytes fit the budget; returns a ticket for release()"""
+        ticket = _Ticket(cost)
+        if not self.enabled:
+            return ticket
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._cond:
+            if not self._waiting and self._fits(ticket):
+                return self._admit(ticket)
+            if len(self._waiting) >= self.max_queued:
+                self._counters['rejected_full'] += 1
+                queued = len(self._waiting)
+            else:
+                queued = None
+        if queued is not None:
+            raise AdmissionRejected(f"Admission queue full ({queued} waiting)", self.retry_after())
+
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._waiting.append(ticket)
+            self._counters['queued'] += 1
+            try:
+                while not (self._waiting[0] is ticket and self._fits(ticket)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['rejected_timeout'] += 1
+                        break
+                    self._cond.wait(remaining)
+                else:
+                    return self._admit(ticket)
+            finally:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    # The next head may fit now that this one is gone
+                    self._cond.notify_all()
+        raise AdmissionRejected(f"No memory budget within {timeout:g}s", self.retry_after())
+
+    def _admit(self, ticket):
+        ticket.admitted_at = time.monotonic()
+        self._in_use += ticket.cost
+        self._in_flight += 1
+        self._counters['admitted'] += 1
+        return ticket
+
+    def release(self, ticket):
+        if ticket is None or ticket.admitted_at is None:
+            return
+        with self._cond:
+            self._in_use -= ticket.cost
+            self._in_flight -= 1
+            self._hold_seconds.append(time.monotonic() - ticket.admitted_at)
+            ticket.admitted_at = None
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'enabled': self.enabled,
+                'budget_mb': round(self.budget_bytes / (1024 * 1024), 1) if self.enabled else None,
+                'in_use_mb': round(self._in_use / (1024 * 1024), 1),
+                'in_flight': self._in_flight,
+                'waiting': len(self._waiting),
+                **self._counters,
+            }
@@ -0,0 +1,402 @@
+"""
+Fused Alpha Post-Processing Engine for Background Removal
+One float32 alpha buffer and one RGB buffer per request: every stage rewrites the
+alpha in place, and the result is converted to uint8 / PIL once, at the end.
+"""
+
+import logging
+
+import numpy as np
+
+from narrow_band import run_band_limited
+from stage_metrics import trace_stage
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+try:
+    from scipy.ndimage import gaussian_filter
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+
+# Stage lists per free preview preset (order matters). 'composite' marks the alpha the
+# RGB is composited with; stages after it only change the output alpha channel.
+FREE_PREVIEW_PRESETS = {
+    'human': [
+        ('trimap', {'fg_threshold': 240, 'bg_threshold': 15, 'expand_radius': 1}),
+        ('recover_weak_mask', {}),
+        ('hair_details', {'strength': 0.10}),
+        ('coverage_check', {}),
+        ('clamp', {'high': 235, 'low': 12}),
+        ('composite', {}),
+    ],
+    'product': [
+        ('trimap', {'fg_threshold': 240, 'bg_threshold': 15, 'expand_radius': 0}),
+        ('recover_weak_mask', {}),
+        ('hair_details', {'strength': 0.10}),
+        ('coverage_check', {}),
+        ('clamp', {'high': 235, 'low': 15}),
+        ('composite', {}),
+    ],
+    'animal': [
+        ('trimap', {'fg_threshold': 235, 'bg_threshold': 20, 'expand_radius': 1}),
+        ('recover_weak_mask', {}),
+        ('hair_details', {'strength': 0.10}),
+        ('coverage_check', {}),
+        ('clamp', {'high': 235, 'low': 15}),
+        ('composite', {}),
+    ],
+    'id_card': [
+        ('trimap', {'fg_threshold': 240, 'bg_threshold': 15, 'expand_radius': 0}),
+        ('binary', {'threshold': 127}),
+        ('recover_weak_mask', {}),
+        ('matte_strength', {'strength': 0.2}),
+        ('coverage_check', {}),
+        ('clamp', {'high': 235, 'low': 15}),
+        ('composite', {}),
+        ('binary', {'threshold': 0.55 * 255}),
+    ],
+    'document': [
+        ('binary', {'threshold': 127}),
+        ('recover_weak_mask', {}),
+        ('matte_strength', {'strength': 0.2}),
+        ('coverage_check', {}),
+        ('clamp', {'high': 235, 'low': 15}),
+        ('composite', {}),
+        ('binary', {'threshold': 0.55 * 255}),
+    ],
+}
+
+# Alpha-only refinement for the premium photo pipeline (after MaxMatting)
+PREMIUM_PRESETS = {
+    'photo': [
+        ('feather', {'is_document': False}),
+        ('halo_removal', {'is_document': False}),
+    ],
+    'document': [
+        ('feather', {'is_document': True}),
+        ('halo_removal', {'is_document': True}),
+    ],
+}
+
+
+def feather_radius_for(megapixels, is_document=False):
+    """Adaptive feather radius in pixels for an image of this size"""
+    if is_document:
+        # Document preset: max 2-3 px feather
+        return min(3, max(2, int(megapixels * 0.5)))
+    if megapixels <= 2:
+        return 2
+    if megapixels <= 5:
+        return 3 if megapixels <= 3 else 4
+    if megapixels <= 10:
+        return 5 if megapixels <= 7 else 6
+    if megapixels <= 18:
+        return 7 if megapixels <= 14 else 9
+    return 10 if megapixels <= 21 else 12  # 18-25 MP
+
+
+def feather_alpha(alpha, feather_radius):
+    """Edge-aware feather of a uint8 alpha (bilateral blend, gaussian without OpenCV), edge band only"""
+    if CV2_AVAILABLE:
+        def feather(alpha_tile):
+            # Apply bilateral filter for edge-aware smoothing
+            feathered = cv2.bilateralFilter(alpha_tile, d=feather_radius * 2 + 1, sigmaColor=75, sigmaSpace=75)
+            # Blend with original to preserve strong alpha values
+            blended = (alpha_tile.astype(np.float32) / 255.0) * 0.7 + (feathered.astype(np.float32) / 255.0) * 0.3
+            return (np.clip(blended, 0, 1) * 255).astype(np.uint8)
+        support = feather_radius
+    else:
+        def feather(alpha_tile):
+            feathered = gaussian_filter(alpha_tile.astype(np.float32) / 255.0, sigma=feather_radius / 2)
+            return (np.clip(feathered, 0, 1) * 255).astype(np.uint8)
+        support = feather_radius * 2 + 1
+    return run_band_limited(feather, alpha, [], alpha, support, 'adaptive_feather')
+
+
+def estimate_background_color(img_array, alpha_array):
+    """
+    Mean color of the background (alpha < 0.1), or of the four corner patches if there is none.
+    Whole-frame statistic: computed once, before any band-limited filtering.
+    """
+    bg_mask = alpha_array < 0.1
+    if np.any(bg_mask):
+        return np.mean(img_array[bg_mask], axis=0)
+    # Fallback: sample from corners
+    h, w = img_array.shape[:2]
+    corners = np.concatenate([
+        img_array[0:max(1, h//10), 0:max(1, w//10)].reshape(-1, 3),
+        img_array[h-max(1, h//10):, 0:max(1, w//10)].reshape(-1, 3),
+        img_array[0:max(1, h//10), w-max(1, w//10):].reshape(-1, 3),
+        img_array[h-max(1, h//10):, w-max(1, w//10):].reshape(-1, 3)
+    ])
+    return np.mean(corners, axis=0)
+
+
+def suppress_halo(alpha, rgb, bg_color, is_document=False):
+    """Lower alpha on light, background-colored edge pixels (alpha 0.7-0.98) of a uint8 alpha"""
+    # Suppression factor: strong for regular images, gentle for documents
+    suppression = 0.3 if not is_document else 0.7
+
+    def suppress(alpha_tile, img_tile):
+        alpha_float = alpha_tile.astype(np.float32) / 255.0
+        edge_mask = (alpha_float >= 0.7) & (alpha_float <= 0.98)
+
+        # Detect white/blue/light colors (potential halo)
+        img_float = img_tile.astype(np.float32)
+        is_light = np.mean(img_float, axis=2) / 255.0 > 0.85
+
+        # Check if edge pixels are similar to background color
+        color_similarity = np.mean(np.abs(img_float - bg_color.reshape(1, 1, 3)), axis=2) < 30
+
+        # Halo: light color + similar to background + in edge region
+        halo_mask = edge_mask & is_light & color_similarity
+        alpha_float[halo_mask] = np.clip(alpha_float[halo_mask] * suppression, 0, 0.98)
+        return (alpha_float * 255).astype(np.uint8)
+
+    # Per-pixel given bg_color: only the edge-band tiles need processing
+    return run_band_limited(suppress, alpha, [rgb], alpha, 0, 'strong_halo_removal')
+
+
+class AlphaEngine:
+    """
+    Runs a stage list over one float32 alpha buffer (0-255 scale) and one uint8 RGB buffer.
+    Stages keep uint8 semantics (values are floored where the old PIL round-trips truncated),
+    so results match the per-function pipeline without its per-stage conversions.
+    """
+
+    def __init__(self, mask, rgb):
+        self.rgb = rgb
+        self.alpha = np.empty(mask.shape, dtype=np.float32)
+        np.copyto(self.alpha, mask)
+        self.debug_stats = {}
+        self.composite_alpha = None
+        self.stopped = False
+        self._uint8 = None
+        self._scratch = None
+
+    # -- buffers ---------------------------------------------------------------
+
+    def to_uint8(self, copy=False):
+        """Current alpha as uint8 (reuses one scratch buffer unless copy=True)"""
+        if copy:
+            return self.alpha.astype(np.uint8)
+        if self._uint8 is None:
+            self._uint8 = np.empty(self.alpha.shape, dtype=np.uint8)
+        np.copyto(self._uint8, self.alpha, casting='unsafe')
+        return self._uint8
+
+    def _scratch_buffer(self):
+        if self._scratch is None:
+            self._scratch = np.empty_like(self.alpha)
+        return self._scratch
+
+    def stats(self, tag):
+        """mask_stats equivalent computed on the float buffer (no conversion)"""
+        alpha = self.alpha
+        return {
+            f"{tag}_min": float(alpha.min()) if alpha.size else 0.0,
+            f"{tag}_max": float(alpha.max()) if alpha.size else 0.0,
+            f"{tag}_shape": alpha.shape,
+            f"{tag}_nonzero": int(np.count_nonzero(alpha)),
+        }
+
+    # -- driver ----------------------------------------------------------------
+
+    def run(self, stages):
+        """Apply stages in order; a stage returning False stops the run. Returns the final uint8 alpha."""
+        for name, params in stages:
+            try:
+                with trace_stage(name):
+                    keep_going = STAGES[name](self, **params)
+            except Exception as e:
+                logger.warning(f"Alpha stage '{name}' failed: {e}, continuing with current alpha")
+                self.debug_stats[f"{name}_error"] = str(e)
+                continue
+            if keep_going is False:
+                self.stopped = True
+                break
+            self.debug_stats.update(self.stats(f"mask_after_{name}"))
+        if self.composite_alpha is None:
+            self.composite_alpha = self.to_uint8(copy=True)
+        return self.to_uint8(copy=True)
+
+
+# -- stages (each rewrites engine.alpha in place) --------------------------------
+
+def stage_trimap(engine, fg_threshold=245, bg_threshold=10, expand_radius=0):
+    """
+    generate_trimap() + 'certain FG -> 255, unknown -> keep, certain BG -> 0'.
+    generate_trimap marks every pixel within expand_radius of FG or BG as unknown, which
+    with OpenCV and expand_radius > 0 is the whole frame: the mask is kept as-is.
+    """
+    if not CV2_AVAILABLE:
+        return
+    engine.debug_stats.update({
+        "trimap_generation_applied": True,
+        "trimap_fg_threshold": fg_threshold,
+        "trimap_bg_threshold": bg_threshold,
+        "trimap_expand_radius": expand_radius,
+    })
+    if expand_radius > 0:
+        return
+    alpha = engine.alpha
+    alpha[alpha > fg_threshold] = 255
+    alpha[alpha < bg_threshold] = 0
+
+
+def stage_binary(engine, threshold=127):
+    """Force binary alpha: > threshold -> 255, else 0"""
+    np.multiply(engine.alpha > threshold, 255, out=engine.alpha, casting='unsafe')
+    engine.debug_stats[f"binary_alpha_{int(threshold)}"] = True
+
+
+def stage_recover_weak_mask(engine):
+    """Free preview mask strength check; weak masks get blur + dilate + threshold recovery (Level 2)"""
+    alpha = engine.alpha
+    total_pixels = alpha.size
+    nonzero_pixels = np.count_nonzero(alpha)
+    nonzero_ratio = nonzero_pixels / total_pixels if total_pixels > 0 else 0.0
+    mask_mean = float(alpha.mean()) if total_pixels else 0.0
+    logger.info(f"📊 Free Preview Mask Stats: nonzero_ratio={nonzero_ratio:.4f}, mean={mask_mean:.2f}")
+    engine.debug_stats.update({
+        "mask_nonzero_ratio": float(nonzero_ratio),
+        "mask_mean": mask_mean,
+        "mask_nonzero_pixels": int(nonzero_pixels),
+        "mask_total_pixels": int(total_pixels),
+        "used_fallback_level": 0,
+        "mask_nonzero_ratio_final_after_recovery": float(nonzero_ratio),
+    })
+
+    # Level 1: weak mask? (relaxed thresholds to preserve borders/hands)
+    if not ((nonzero_ratio < 0.002) or (mask_mean < 15)):
+        logger.info("✅ Mask strength OK, no recovery needed")
+        return
+    if not CV2_AVAILABLE:
+        logger.warning("CV2 not available, skipping recovery; no emergency cut to preserve edges/hands.")
+        return
+
+    logger.warning(f"⚠️ Weak mask detected (ratio={nonzero_ratio:.4f}, mean={mask_mean:.2f}). Applying Level 2 recovery...")
+    # Level 2: gentle blur, dilate, normalize, threshold at 60 (keep more edges)
+    blurred = cv2.GaussianBlur(alpha, (3, 3), 1.0, dst=engine._scratch_buffer())
+    dilated = cv2.dilate(blurred.astype(np.uint8), np.ones((5, 5), np.uint8), iterations=1)
+    normalized = cv2.normalize(dilated.astype(np.float32), None, 0, 255, cv2.NORM_MINMAX)
+    np.multiply(normalized > 60, 255, out=alpha, casting='unsafe')
+
+    recovered_nonzero = np.count_nonzero(alpha)
+    recovered_ratio = recovered_nonzero / total_pixels if total_pixels > 0 else 0.0
+    recovered_mean = float(alpha.mean())
+    logger.info(f"✅ Level 2 recovery applied: new_ratio={recovered_ratio:.4f}, new_mean={recovered_mean:.2f}")
+    if recovered_ratio < 0.005 or recovered_mean < 20:
+        logger.warning("⚠️ Mask still weak after Level 2. Skipping emergency cut to preserve edges/hands.")
+    engine.debug_stats.update({
+        "used_fallback_level": 1,
+        "recovery_level_2_applied": True,
+        "recovery_nonzero_ratio": float(recovered_ratio),
+        "recovery_mean": recovered_mean,
+        "mask_nonzero_ratio_after_recovery": float(recovered_ratio),
+        "mask_nonzero_ratio_final_after_recovery": float(recovered_ratio),
+    })
+
+
+def stage_hair_details(engine, strength=0.3):
+    """Boost alpha on image edges (Canny) to keep fine hair strands - no blur"""
+    if not CV2_AVAILABLE:
+        return
+    gray = cv2.cvtColor(engine.rgb, cv2.COLOR_RGB2GRAY)
+    edge_mask = cv2.Canny(gray, 50, 150) > 0
+    alpha = engine.alpha
+    alpha[edge_mask] = np.floor(np.minimum(255, alpha[edge_mask] * (1.0 + strength)))
+
+
+def stage_matte_strength(engine, strength=0.2):
+    """Boost alpha above 128 to preserve text and fine details"""
+    alpha = engine.alpha
+    boost = alpha > 128
+    alpha[boost] = np.floor(np.minimum(255, alpha[boost] * (1.0 + strength)))
+
+
+def stage_anti_bleed(engine, blur_radius=2):
+    """Smooth the alpha edge; strong FG (>200) and BG (<50) keep 90% of their value"""
+    if not CV2_AVAILABLE:
+        return
+    alpha = engine.alpha
+    size = blur_radius * 2 + 1
+    blurred = cv2.GaussianBlur(alpha, (size, size), blur_radius, dst=engine._scratch_buffer())
+    strong = (alpha > 200) | (alpha < 50)
+    blurred[strong] = alpha[strong] * 0.9 + blurred[strong] * 0.1
+    np.floor(blurred, out=alpha)
+
+
+def stage_coverage_check(engine, min_percent=1.0):
+    """Stop (caller falls back to the raw cutout) when under min_percent of pixels have alpha"""
+    alpha_nonzero = np.count_nonzero(engine.alpha)
+    total_pixels = engine.alpha.size
+    alpha_percent = (alpha_nonzero / total_pixels) * 100.0 if total_pixels else 0.0
+    logger.info(f"Alpha check: {alpha_nonzero}/{total_pixels} pixels ({alpha_percent:.2f}%) have non-zero alpha")
+    engine.debug_stats.update({
+        "alpha_nonzero_count": int(alpha_nonzero),
+        "alpha_percent": float(alpha_percent),
+        "total_pixels": int(total_pixels),
+    })
+    if alpha_percent < min_percent:
+        logger.warning(f"⚠️ Alpha too low ({alpha_percent:.2f}%) - falling back to raw model output")
+        engine.debug_stats["fallback_to_raw"] = True
+        return False
+
+
+def stage_clamp(engine, high=235, low=12):
+    """Hard alpha clamp: >= high -> 255, <= low -> 0"""
+    alpha = engine.alpha
+    alpha[alpha >= high] = 255
+    alpha[alpha <= low] = 0
+    engine.debug_stats.update({"alpha_clamp_max": high, "alpha_clamp_min": low})
+
+
+def stage_composite(engine):
+    """Snapshot the alpha used to composite the RGB"""
+    engine.composite_alpha = engine.to_uint8(copy=True)
+
+
+def stage_feather(engine, is_document=False):
+    """Adaptive feather (radius from megapixels), edge band only"""
+    if not SCIPY_AVAILABLE:
+        return
+    height, width = engine.alpha.shape
+    megapixels = (width * height) / 1_000_000
+    radius = feather_radius_for(megapixels, is_document)
+    logger.info(f"Adaptive feather: {megapixels:.2f} MP → radius {radius} px")
+    np.copyto(engine.alpha, feather_alpha(engine.to_uint8(), radius))
+    engine.debug_stats["adaptive_feather_radius"] = radius
+
+
+def stage_halo_removal(engine, is_document=False):
+    """Strong (photo) / gentle (document) halo suppression on alpha 0.7-0.98"""
+    alpha = engine.alpha
+    if not np.any((alpha >= 0.7 * 255) & (alpha <= 0.98 * 255)):
+        return
+    alpha_uint8 = engine.to_uint8()
+    bg_color = estimate_background_color(engine.rgb, alpha_uint8.astype(np.float32) / 255.0)
+    np.copyto(alpha, suppress_halo(alpha_uint8, engine.rgb, bg_color, is_document))
+
+
+STAGES = {
+    'trimap': stage_trimap,
+    'binary': stage_binary,
+    'recover_weak_mask': stage_recover_weak_mask,
+    'hair_details': stage_hair_details,
+    'matte_strength': stage_matte_strength,
+    'anti_bleed': stage_anti_bleed,
+    'coverage_check': stage_coverage_check,
+    'clamp': stage_clamp,
+    'composite': stage_composite,
+    'feather': stage_feather,
+    'halo_removal': stage_halo_removal,
+}
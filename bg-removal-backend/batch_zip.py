@@ -0,0 +1,68 @@
+"""
+Streaming Zip Output for Batch Background Removal
+Writes a zip archive entry by entry into an in-memory buffer that is drained after
+every entry, so each finished image can be sent to the client while the rest run.
+"""
+
+import os
+import time
+import zipfile
+
+# Most images a single batch request may contain
+BATCH_MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES', '50'))
+# Images decoded and sent through one batched inference run
+BATCH_INFERENCE_SIZE = int(os.environ.get('BATCH_INFERENCE_SIZE', '4'))
+
+
+class _ChunkWriter:
+    """Write-only sink for ZipFile; no seek/tell, so ZipFile writes data descriptors instead"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ZipStream:
+    """
+    Incremental zip writer: add() and close() hand back the archive bytes produced so far.
+    PNG/JPEG results are already compressed, so entries are stored by default.
+    """
+
+    def __init__(self, compression=zipfile.ZIP_STORED):
+        self._writer = _ChunkWriter()
+        self._zip = zipfile.ZipFile(self._writer, mode='w', compression=compression)
+        self._names = set()
+
+    def unique_name(self, name):
+        """name, or name with a -2/-3/... suffix if an entry already uses it"""
+        stem, ext = os.path.splitext(name)
+        candidate, counter = name, 2
+        while candidate in self._names:
+            candidate = f"{stem}-{counter}{ext}"
+            counter += 1
+        return candidate
+
+    def add(self, name, data):
+        """Add one entry -> (entry name actually used, archive bytes to send)"""
+        name = self.unique_name(name)
+        self._names.add(name)
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = self._zip.compression
+        self._zip.writestr(info, data)
+        return name, self._writer.drain()
+
+    def close(self):
+        """Write the central directory; returns the final bytes of the archive"""
+        self._zip.close()
+        return self._writer.drain()
@@ -0,0 +1,157 @@
+"""
+Dynamic Micro-Batching for Free Preview Inference
+Collects concurrent preview requests for a few milliseconds, runs them as one
+batched ONNX call per session, and hands each mask back to its request. A preview with
+no other preview in flight runs directly in its own thread: no wait, no hand-off.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from inference import predict_mask, predict_masks
+from inference_pool import InferencePoolBusy
+
+logger = logging.getLogger(__name__)
+
+# Max previews per batched ONNX run (1 = batching disabled)
+PREVIEW_BATCH_MAX_SIZE = int(os.environ.get('PREVIEW_BATCH_MAX_SIZE', '4'))
+# How long the first request in a batch waits for company (milliseconds)
+PREVIEW_BATCH_WAIT_MS = float(os.environ.get('PREVIEW_BATCH_WAIT_MS', '10'))
+
+
+class MicroBatcher:
+    """
+    Batching scheduler in front of predict_masks().
+    Requests block in predict() until their batch has run; one daemon thread drains the queue.
+    A request arriving while no other preview is in flight runs solo, in the calling thread.
+    """
+
+    def __init__(self, max_batch_size=PREVIEW_BATCH_MAX_SIZE, max_wait_ms=PREVIEW_BATCH_WAIT_MS):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_seconds = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # In flight: previews running solo, and queued previews whose batch hasn't finished
+        self._solo_running = 0
+        self._pending = 0
+        self._solo = 0
+        self._batches = 0
+        self._items = 0
+        self._largest_batch = 0
+
+    @property
+    def enabled(self):
+        return self.max_batch_size > 1
+
+    def predict(self, session, image, output_size=None):
+        """Return the uint8 mask for image; batched with concurrent callers when enabled"""
+        if not self.enabled:
+            return predict_mask(session, image, output_size)
+        with self._stats_lock:
+            solo = self._solo_running + self._pending == 0
+            if solo:
+                self._solo_running += 1
+                self._solo += 1
+            else:
+                self._pending += 1
+        if solo:
+            try:
+                return predict_mask(session, image, output_size)
+            finally:
+                with self._stats_lock:
+                    self._solo_running -= 1
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((session, image, output_size, future))
+        return future.result()
+
+    def _others_in_flight(self, collected):
+        """Whether previews beyond the `collected` ones are in flight (solo or on their way to the queue)"""
+        with self._stats_lock:
+            return self._solo_running + self._pending > collected
+
+    def _ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='preview-micro-batcher', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        """
+        Block for the first request, then gather more until the batch is full or the window
+        closes. There's no window when no other preview is in flight: nobody could join.
+        """
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._others_in_flight(len(items)):
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            # Requests can target different sessions (e.g. document previews); batch per session
+            groups = {}
+            for item in items:
+                groups.setdefault(id(item[0]), []).append(item)
+            for group in groups.values():
+                self._run_group(group)
+
+    def _run_group(self, group):
+        session = group[0][0]
+        try:
+            masks = predict_masks(session, [item[1] for item in group], [item[2] for item in group])
+        except InferencePoolBusy as e:
+            # Retrying one by one would only queue more work behind a full pool
+            for item in group:
+                item[3].set_exception(e)
+            self._finished(len(group))
+            return
+        except Exception as e:
+            logger.warning(f"Batched preview inference failed ({len(group)} images): {e}, retrying one by one")
+            masks = None
+        for index, (_, image, output_size, future) in enumerate(group):
+            if masks is not None:
+                future.set_result(masks[index])
+                continue
+            try:
+                future.set_result(predict_mask(session, image, output_size))
+            except Exception as e:
+                future.set_exception(e)
+        self._finished(len(group))
+        with self._stats_lock:
+            self._batches += 1
+            self._items += len(group)
+            self._largest_batch = max(self._largest_batch, len(group))
+
+    def _finished(self, count):
+        with self._stats_lock:
+            self._pending -= count
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'enabled': self.enabled,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_seconds * 1000.0,
+                'batches': self._batches,
+                'items': self._items,
+                'avg_batch_size': round(self._items / self._batches, 2) if self._batches else 0.0,
+                'largest_batch': self._largest_batch,
+                'solo': self._solo,
+                'queued': self._queue.qsize(),
+            }
@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Background Removal Service
+Run locally against synthetic images; no GPU required ('startup' launches its own app server).
+
+Usage:
+    python benchmark.py inference                 # PNG round-trip overhead vs in-memory arrays
+    python benchmark.py inference --model u2netp  # full remove() vs predict_mask() with a real model
+    python benchmark.py batching --model birefnet # N serial preview runs vs one batched run
+    python benchmark.py narrowband                # full-frame vs edge-band post-processing filters
+    python benchmark.py tiledmatting --model isnet-general-use  # full-frame vs coarse-to-fine matting
+    python benchmark.py workerpool --model u2netp  # shared session vs workers x threads splits under load
+    python benchmark.py encoders                  # encode time and bytes per output encoder profile
+    python benchmark.py startup                   # time to /health and to the first preview per STARTUP_MODE
+    python benchmark.py int8 --images photos/     # int8 vs fp32 preview masks: IoU, edge error, latency
+    python benchmark.py stagegraph                # premium semantic + matting stages: sequential vs concurrent
+    python benchmark.py docfastpath --images docs/  # classical document masks vs the model: take rate, time saved
+    python benchmark.py analysis                  # pre-inference analysis: full resolution vs downsampled / JPEG draft
+"""
+
+import argparse
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+from PIL import Image
+
+from inference import predict_mask, predict_masks, supports_batching, to_rgb_array
+
+DEFAULT_MEGAPIXELS = [1, 4, 9, 16, 25]
+
+
+def synthetic_image(megapixels, seed=0):
+    """Photo-like RGB test image: smooth gradients plus sensor-style noise (realistic PNG cost)"""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1_000_000 / width)
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        128 + 100 * np.sin(x / 97.0),
+        128 + 100 * np.cos(y / 131.0),
+        128 + 100 * np.sin((x + y) / 173.0),
+    ], axis=2)
+    noise = rng.normal(0, 6, size=base.shape)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), mode='RGB')
+
+
+def _timed(fn, repeats):
+    """Best-of-N wall time in seconds"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _png_round_trip(image):
+    """What every rembg.remove(bytes) call paid outside the model: encode, decode, encode, decode"""
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    decoded = Image.open(io.BytesIO(buffer.getvalue()))
+    decoded.load()
+    rgba = decoded.convert('RGBA')
+    out_buffer = io.BytesIO()
+    rgba.save(out_buffer, format='PNG')
+    result = Image.open(io.BytesIO(out_buffer.getvalue()))
+    return np.array(result.split()[3])
+
+
+def _array_path(image):
+    """What predict_mask() pays outside the model: one zero-copy array view"""
+    return to_rgb_array(image)
+
+
+def bench_inference(args):
+    """Compare PNG round-trip vs in-memory inference per megapixel"""
+    session = None
+    if args.model:
+        from rembg import new_session, remove
+        session = new_session(args.model)
+
+    print(f"{'MP':>5} {'png_ms':>10} {'array_ms':>10} {'saved_ms':>10} {'saved_ms/MP':>12}")
+    for mp in args.megapixels:
+        image = synthetic_image(mp)
+        actual_mp = image.size[0] * image.size[1] / 1_000_000
+        if session is None:
+            png_s = _timed(lambda: _png_round_trip(image), args.repeats)
+            array_s = _timed(lambda: _array_path(image), args.repeats)
+        else:
+            def png_path():
+                buffer = io.BytesIO()
+                image.save(buffer, format='PNG')
+                output = Image.open(io.BytesIO(remove(buffer.getvalue(), session=session)))
+                return np.array(output.split()[3])
+            png_s = _timed(png_path, args.repeats)
+            array_s = _timed(lambda: predict_mask(session, image), args.repeats)
+        saved_ms = (png_s - array_s) * 1000
+        print(f"{actual_mp:5.1f} {png_s * 1000:10.1f} {array_s * 1000:10.1f} {saved_ms:10.1f} {saved_ms / actual_mp:12.1f}")
+
+
+def bench_batching(args):
+    """Compare N serial 512px preview inferences against one batched ONNX run"""
+    from rembg import new_session
+    session = new_session(args.model)
+    if not supports_batching(session):
+        print(f"Model '{args.model}' has a fixed batch size of 1; batched runs fall back to serial")
+    images = [synthetic_image(0.2, seed=i) for i in range(args.batch_size)]
+    serial_s = _timed(lambda: [predict_mask(session, image) for image in images], args.repeats)
+    batched_s = _timed(lambda: predict_masks(session, images), args.repeats)
+    print(f"{'batch':>5} {'serial_ms':>10} {'batched_ms':>11} {'speedup':>8}")
+    print(f"{args.batch_size:5d} {serial_s * 1000:10.1f} {batched_s * 1000:11.1f} {serial_s / batched_s:8.2f}x")
+
+
+def synthetic_portrait_alpha(width, height, seed=0):
+    """Head-and-shoulders style alpha: solid ellipses with a soft, ragged (hair-like) edge"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    head = ((x - width * 0.5) / (width * 0.18)) ** 2 + ((y - height * 0.35) / (height * 0.22)) ** 2
+    body = ((x - width * 0.5) / (width * 0.42)) ** 2 + ((y - height * 1.05) / (height * 0.5)) ** 2
+    distance = np.minimum(head, body)
+    ragged = distance + rng.normal(0, 0.01, size=distance.shape).astype(np.float32)
+    # ~6 px soft edge at 1 MP, scaled with resolution
+    softness = 0.006 * (1_000_000 / (width * height)) ** 0.5 * 6
+    alpha = np.clip((1.0 - ragged) / softness, 0, 1)
+    return (alpha * 255).astype(np.uint8)
+
+
+def bench_narrowband(args):
+    """Full-frame vs band-limited post-processing filters on a synthetic portrait"""
+    import narrow_band
+    from narrow_band import band_regions
+    import app
+
+    print(f"{'MP':>5} {'filter':>22} {'band%':>6} {'full_ms':>9} {'band_ms':>9} {'speedup':>8} {'max_diff':>9}")
+    for mp in args.megapixels:
+        image = synthetic_image(mp)
+        rgb = to_rgb_array(image)
+        alpha = synthetic_portrait_alpha(image.size[0], image.size[1])
+        alpha_img = Image.fromarray(alpha, mode='L')
+        rgba = np.dstack([rgb, alpha])
+        filters = [
+            ('adaptive_feather', lambda: app.adaptive_feather_alpha(alpha_img, image.size[0], image.size[1])),
+            ('strong_halo_removal', lambda: app.strong_halo_removal_alpha(alpha_img, rgb)),
+            ('color_decontamination', lambda: app.color_decontamination(rgba, rgb)),
+            ('guided_filter', lambda: app.guided_filter(rgb, alpha_img)),
+            ('enhance_hair_details', lambda: app.enhance_hair_details(alpha_img, rgb)),
+            ('clean_matte_edges', lambda: app.clean_matte_edges(alpha_img, rgb)),
+        ]
+        _, coverage = band_regions(alpha, 16)
+        for name, run in filters:
+            narrow_band.NARROW_BAND_FILTERS = False
+            full_s = _timed(run, args.repeats)
+            full = np.asarray(run(), dtype=np.int16)
+            narrow_band.NARROW_BAND_FILTERS = True
+            band_s = _timed(run, args.repeats)
+            band = np.asarray(run(), dtype=np.int16)
+            max_diff = int(np.abs(full - band).max())
+            print(f"{mp:5.1f} {name:>22} {coverage * 100:6.1f} {full_s * 1000:9.1f} {band_s * 1000:9.1f} "
+                  f"{full_s / band_s:7.2f}x {max_diff:9d}")
+
+
+def _matting_worker(model, mp, mode, queue):
+    """Child process: one matting run, reports wall time and peak RSS growth"""
+    import resource
+    from rembg import new_session
+    from tiled_matting import refine_boundary_tiles
+    session = new_session(model)
+    image = synthetic_image(mp)
+    rgb = to_rgb_array(image)
+    alpha = synthetic_portrait_alpha(image.size[0], image.size[1])
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == 'tiled':
+        tiles = refine_boundary_tiles(session, rgb, alpha)['matting_tiles']
+    else:
+        predict_mask(session, rgb)
+        tiles = 0
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, (peak_kb - baseline_kb) / 1024.0, tiles))
+
+
+def bench_tiledmatting(args):
+    """Full-frame vs coarse-to-fine matting: latency and peak memory growth per megapixel"""
+    import multiprocessing
+    context = multiprocessing.get_context('spawn')
+    print(f"{'MP':>5} {'mode':>6} {'tiles':>6} {'time_ms':>9} {'peak_rss_mb':>12}")
+    for mp in args.megapixels:
+        for mode in ('full', 'tiled'):
+            queue = context.Queue()
+            worker = context.Process(target=_matting_worker, args=(args.model, mp, mode, queue))
+            worker.start()
+            elapsed, peak_mb, tiles = queue.get()
+            worker.join()
+            print(f"{mp:5.1f} {mode:>6} {tiles:6d} {elapsed * 1000:9.1f} {peak_mb:12.1f}")
+
+
+def _run_clients(session, images, concurrency, total):
+    """`concurrency` client threads share `total` predict_mask calls; returns (wall_s, latencies_s)"""
+    import threading
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def client():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            predict_mask(session, images[index % len(images)])
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, sorted(latencies)
+
+
+def bench_workerpool(args):
+    """Throughput and tail latency of the shared session vs inference pool layouts under concurrent load"""
+    from rembg import new_session
+    from inference_pool import InferencePool, available_cores, choose_layout, parse_layout
+
+    cores = available_cores()
+    concurrency = args.concurrency or 2 * cores
+    images = [synthetic_image(args.megapixels, seed=i) for i in range(4)]
+    layouts = [parse_layout(layout) for layout in args.layouts] if args.layouts else \
+        [(cores // threads, threads) for threads in range(1, cores + 1) if cores % threads == 0]
+    print(f"{cores} cores, {concurrency} concurrent clients, {args.requests} requests, "
+          f"'auto' layout = {'x'.join(map(str, choose_layout(cores)))}")
+    print(f"{'layout':>8} {'req/s':>8} {'p50_ms':>9} {'p95_ms':>9}")
+
+    def report(label, session):
+        predict_mask(session, images[0])  # warm-up
+        wall, latencies = _run_clients(session, images, concurrency, args.requests)
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"{label:>8} {args.requests / wall:8.2f} {p50 * 1000:9.1f} {p95 * 1000:9.1f}")
+        return args.requests / wall
+
+    report('shared', new_session(args.model))
+    results = {}
+    for workers, threads in layouts:
+        pool = InferencePool(workers, threads, queue_size=max(16, concurrency))
+        pool.warm(args.model)
+        results[(workers, threads)] = report(f"{workers}x{threads}", pool.get(args.model))
+    best = max(results, key=results.get)
+    print(f"Best throughput: INFERENCE_POOL={best[0]}x{best[1]}")
+
+
+def encoder_corpus(megapixels, paths=None):
+    """Fixed RGBA cutouts (synthetic photo + portrait alpha, fixed seeds), or the given image files"""
+    if paths:
+        return [(path.rsplit('/', 1)[-1], Image.open(path).convert('RGBA')) for path in paths]
+    corpus = []
+    for index, mp in enumerate(megapixels):
+        image = synthetic_image(mp, seed=index)
+        image.putalpha(Image.fromarray(synthetic_portrait_alpha(image.size[0], image.size[1], seed=index), mode='L'))
+        corpus.append((f"synthetic-{mp:g}mp", image))
+    return corpus
+
+
+def bench_encoders(args):
+    """Encode time and output size of every encoder profile on a fixed image corpus"""
+    from encoders import ENCODER_PROFILES, encode_image, select_profile
+
+    print(f"{'image':>18} {'MP':>5} {'profile':>14} {'encode_ms':>10} {'KB':>9} {'bytes/px':>9} {'default':>8}")
+    for name, image in encoder_corpus(args.megapixels, args.images):
+        mp = image.size[0] * image.size[1] / 1_000_000
+        defaults = {select_profile(mp), select_profile(mp, webp_ok=True)}
+        for profile in args.profiles or ENCODER_PROFILES:
+            source = image.convert('RGB') if profile == 'jpeg' else image
+            encoded_s = _timed(lambda: encode_image(source, profile), args.repeats)
+            size = len(encode_image(source, profile))
+            print(f"{name:>18} {mp:5.1f} {profile:>14} {encoded_s * 1000:10.1f} {size / 1024:9.1f} "
+                  f"{size / (mp * 1_000_000):9.3f} {'*' if profile in defaults else '':>8}")
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _multipart_body(field, filename, data, content_type):
+    boundary = f"----benchmark{int(time.time() * 1000)}"
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: {content_type}\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def _poll(url, deadline, accept=lambda response: True):
+    """Poll GET url until it answers 200 and accept(json body) holds"""
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                if accept(json.loads(response.read())):
+                    return
+        except (urllib.error.URLError, ConnectionError, OSError, ValueError):
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"{url} not ready before the deadline")
+
+
+def bench_startup(args):
+    """Cold start per STARTUP_MODE: app started in a subprocess, time to /health, first preview, all models warm"""
+    buffer = io.BytesIO()
+    synthetic_image(0.5).save(buffer, format='JPEG', quality=90)
+    body, content_type = _multipart_body('image', 'probe.jpg', buffer.getvalue(), 'image/jpeg')
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+
+    print(f"{'mode':>8} {'health_s':>9} {'first_preview_s':>16} {'all_warm_s':>11}")
+    for mode in args.modes:
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ, STARTUP_MODE=mode, PORT=str(port), RESULT_CACHE_MEMORY_MB='0')
+        start = time.perf_counter()
+        deadline = start + args.timeout
+        server = subprocess.Popen([sys.executable, 'app.py'], cwd=app_dir, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _poll(f"{base_url}/health", deadline)
+            health_s = time.perf_counter() - start
+            request = urllib.request.Request(f"{base_url}/api/free-preview-bg?response=binary", data=body,
+                                             headers={'Content-Type': content_type})
+            with urllib.request.urlopen(request, timeout=args.timeout) as response:
+                response.read()
+            preview_s = time.perf_counter() - start
+            _poll(f"{base_url}/ready", deadline, accept=lambda status: all(
+                stage['state'] in ('warm', 'failed') for stage in status['stages'].values()))
+            all_warm_s = time.perf_counter() - start
+            print(f"{mode:>8} {health_s:9.2f} {preview_s:16.2f} {all_warm_s:11.2f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def _dilate(mask, radius):
+    """Binary dilation by a (2r+1)^2 square, numpy only"""
+    out = mask.copy()
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            shifted = np.zeros_like(mask)
+            ys = slice(max(dy, 0), mask.shape[0] + min(dy, 0))
+            xs = slice(max(dx, 0), mask.shape[1] + min(dx, 0))
+            yd = slice(max(-dy, 0), mask.shape[0] + min(-dy, 0))
+            xd = slice(max(-dx, 0), mask.shape[1] + min(-dx, 0))
+            shifted[ys, xs] = mask[yd, xd]
+            out |= shifted
+    return out
+
+
+def mask_agreement(reference, candidate, edge_radius=3):
+    """
+    IoU of the binarized masks (threshold 128) and the mean / 95th percentile absolute alpha
+    error (0-255) in the reference's edge band, where quantization error shows first.
+    """
+    from narrow_band import edge_band
+    ref_fg, cand_fg = reference >= 128, candidate >= 128
+    union = np.count_nonzero(ref_fg | cand_fg)
+    iou = np.count_nonzero(ref_fg & cand_fg) / union if union else 1.0
+    band = _dilate(edge_band(np.where(ref_fg, 255, 0).astype(np.uint8)) | edge_band(reference), edge_radius)
+    error = np.abs(reference.astype(np.int16) - candidate.astype(np.int16))[band]
+    edge_mae = float(error.mean()) if error.size else 0.0
+    edge_p95 = float(np.percentile(error, 95)) if error.size else 0.0
+    return iou, edge_mae, edge_p95
+
+
+def bench_int8(args):
+    """Regression harness: int8 preview model vs fp32 on a local image set (exit 1 below the thresholds)"""
+    from model_registry import default_session_factory
+    from quantized_models import QUANTIZED_VARIANTS
+
+    base_model = QUANTIZED_VARIANTS[args.variant][0]
+    fp32, int8 = default_session_factory(base_model), default_session_factory(args.variant)
+    paths = sorted(os.path.join(args.images, name) for name in os.listdir(args.images)
+                   if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.bmp')))
+    if not paths:
+        raise SystemExit(f"No images in {args.images}")
+
+    print(f"{'image':>28} {'fp32_ms':>8} {'int8_ms':>8} {'IoU':>7} {'edge_mae':>9} {'edge_p95':>9}")
+    rows = []
+    for path in paths:
+        image = Image.open(path).convert('RGB')
+        image.thumbnail((args.size, args.size), Image.Resampling.LANCZOS)  # preview process size
+        rgb = to_rgb_array(image)
+        fp32_s = _timed(lambda: predict_mask(fp32, rgb), args.repeats)
+        int8_s = _timed(lambda: predict_mask(int8, rgb), args.repeats)
+        iou, edge_mae, edge_p95 = mask_agreement(predict_mask(fp32, rgb), predict_mask(int8, rgb))
+        rows.append((fp32_s, int8_s, iou, edge_mae))
+        print(f"{os.path.basename(path)[-28:]:>28} {fp32_s * 1000:8.1f} {int8_s * 1000:8.1f} "
+              f"{iou:7.4f} {edge_mae:9.2f} {edge_p95:9.1f}")
+
+    fp32_ms, int8_ms, ious, maes = (np.array(column) for column in zip(*rows))
+    print(f"\n{len(rows)} images: mean latency {fp32_ms.mean() * 1000:.1f} -> {int8_ms.mean() * 1000:.1f} ms "
+          f"({fp32_ms.mean() / int8_ms.mean():.2f}x), IoU mean {ious.mean():.4f} / min {ious.min():.4f}, "
+          f"edge MAE mean {maes.mean():.2f} / max {maes.max():.2f}")
+    if ious.min() < args.min_iou or maes.max() > args.max_edge_mae:
+        print(f"FAIL: below --min-iou {args.min_iou} or above --max-edge-mae {args.max_edge_mae}")
+        raise SystemExit(1)
+    print("PASS")
+
+
+def bench_stagegraph(args):
+    """Premium semantic inference + matting: sequential vs concurrent stage graph"""
+    from rembg import new_session
+    from stage_graph import StageGraph
+    semantic, matting = new_session(args.semantic_model), new_session(args.matting_model)
+
+    def graph_run(image, workers):
+        graph = StageGraph(workers=workers)
+        graph.add('rgb', lambda: to_rgb_array(image))
+        graph.add('semantic', lambda rgb: predict_mask(semantic, rgb), deps=('rgb',))
+        graph.add('matting', lambda rgb: predict_mask(matting, rgb), deps=('rgb',))
+        return graph.run()
+
+    print(f"{'MP':>5} {'sequential_ms':>14} {'graph_ms':>9} {'speedup':>8}   (workers: {args.workers})")
+    for mp in args.megapixels:
+        image = synthetic_image(mp)
+        graph_run(image, args.workers)  # warm-up: first-run ONNX setup
+        sequential_s = _timed(lambda: graph_run(image, 1), args.repeats)
+        concurrent_s = _timed(lambda: graph_run(image, args.workers), args.repeats)
+        print(f"{mp:5.1f} {sequential_s * 1000:14.1f} {concurrent_s * 1000:9.1f} {sequential_s / concurrent_s:7.2f}x")
+
+
+def bench_docfastpath(args):
+    """Document fast path vs the model on a local set of document images: how often it's taken, time saved"""
+    from rembg import new_session
+    from document_fastpath import DocumentFastPath
+    session = new_session(args.model)
+    fast_path = DocumentFastPath(enabled=True, min_confidence=args.min_confidence)
+    if not fast_path.enabled:
+        raise SystemExit("Document fast path needs OpenCV (cv2)")
+    paths = sorted(os.path.join(args.images, name) for name in os.listdir(args.images)
+                   if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.bmp')))
+    if not paths:
+        raise SystemExit(f"No images in {args.images}")
+
+    print(f"{'image':>28} {'conf':>5} {'taken':>5} {'fast_ms':>8} {'model_ms':>9} {'IoU':>7}")
+    rows = []
+    for path in paths:
+        rgb = to_rgb_array(Image.open(path).convert('RGB'))
+        stats = {}
+        start = time.perf_counter()
+        fast_mask = fast_path.try_segment(rgb, stats)
+        fast_s = time.perf_counter() - start
+        model_s = _timed(lambda: predict_mask(session, rgb), args.repeats)
+        decision = stats['document_fast_path']
+        iou = mask_agreement(predict_mask(session, rgb), fast_mask)[0] if fast_mask is not None else float('nan')
+        rows.append((fast_mask is not None, fast_s, model_s, iou))
+        print(f"{os.path.basename(path)[-28:]:>28} {decision['confidence']:5.2f} {'yes' if fast_mask is not None else 'no':>5} "
+              f"{fast_s * 1000:8.1f} {model_s * 1000:9.1f} {iou:7.4f}")
+
+    taken = [row for row in rows if row[0]]
+    # Gated images pay the fast path attempt on top of the model run
+    saved_s = sum(model_s - fast_s for _, fast_s, model_s, _ in taken) - sum(fast_s for ok, fast_s, _, _ in rows if not ok)
+    baseline_s = sum(model_s for _, _, model_s, _ in rows)
+    print(f"\nFast path taken for {len(taken)}/{len(rows)} documents ({len(taken) / len(rows):.0%}) "
+          f"at min confidence {args.min_confidence:g}")
+    print(f"Latency: {baseline_s / len(rows) * 1000:.1f} -> {(baseline_s - saved_s) / len(rows) * 1000:.1f} ms "
+          f"per document ({saved_s / baseline_s:.0%} saved)")
+    if taken:
+        ious = np.array([row[3] for row in taken])
+        print(f"IoU vs model on taken documents: mean {ious.mean():.4f}, min {ious.min():.4f}")
+
+
+def _full_resolution_features(image):
+    """The pre-inference features as computed before image_analysis: on every pixel"""
+    import cv2
+    rgb = np.asarray(image)
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    edges = cv2.Canny(gray, 50, 150)
+    return float(np.std(gray)), float(np.mean(rgb)) / 255.0, float(np.count_nonzero(edges)) / edges.size
+
+
+def bench_analysis(args):
+    """Image-type analysis time per upload size: full resolution vs downsampled copy vs JPEG draft decode"""
+    from image_analysis import ImageAnalysis
+
+    def features(analysis):
+        return analysis.gray_std, analysis.brightness, analysis.edge_density
+
+    print(f"{'MP':>5} {'full_ms':>8} {'reduce_ms':>10} {'draft_ms':>9}   (draft includes the reduced JPEG decode)")
+    for mp in args.megapixels:
+        image = synthetic_image(mp)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=90)
+        encoded = buffer.getvalue()
+        full_s = _timed(lambda: _full_resolution_features(image), args.repeats)
+        reduce_s = _timed(lambda: features(ImageAnalysis.from_image(image)), args.repeats)
+        draft_s = _timed(lambda: features(ImageAnalysis.from_encoded(encoded)), args.repeats)
+        print(f"{mp:5.1f} {full_s * 1000:8.1f} {reduce_s * 1000:10.1f} {draft_s * 1000:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    inference_parser = subparsers.add_parser('inference', help='PNG round-trip vs in-memory inference')
+    inference_parser.add_argument('--model', default=None, help='rembg model name for an end-to-end run (optional)')
+    inference_parser.add_argument('--megapixels', type=float, nargs='+', default=DEFAULT_MEGAPIXELS)
+    inference_parser.add_argument('--repeats', type=int, default=3)
+    inference_parser.set_defaults(func=bench_inference)
+
+    batching_parser = subparsers.add_parser('batching', help='serial vs micro-batched preview inference')
+    batching_parser.add_argument('--model', required=True, help='rembg model name')
+    batching_parser.add_argument('--batch-size', type=int, default=4)
+    batching_parser.add_argument('--repeats', type=int, default=3)
+    batching_parser.set_defaults(func=bench_batching)
+
+    narrowband_parser = subparsers.add_parser('narrowband', help='full-frame vs edge-band post-processing filters')
+    narrowband_parser.add_argument('--megapixels', type=float, nargs='+', default=[4, 12, 25])
+    narrowband_parser.add_argument('--repeats', type=int, default=3)
+    narrowband_parser.set_defaults(func=bench_narrowband)
+
+    tiledmatting_parser = subparsers.add_parser('tiledmatting', help='full-frame vs coarse-to-fine matting')
+    tiledmatting_parser.add_argument('--model', required=True, help='rembg matting model name')
+    tiledmatting_parser.add_argument('--megapixels', type=float, nargs='+', default=[4, 12, 25])
+    tiledmatting_parser.set_defaults(func=bench_tiledmatting)
+
+    workerpool_parser = subparsers.add_parser('workerpool', help='shared session vs inference pool layouts')
+    workerpool_parser.add_argument('--model', required=True, help='rembg model name')
+    workerpool_parser.add_argument('--layouts', nargs='+', default=None,
+                                   help="WxT splits to try (default: every split of the core count)")
+    workerpool_parser.add_argument('--megapixels', type=float, default=0.25, help='input image size per request')
+    workerpool_parser.add_argument('--concurrency', type=int, default=0, help='client threads (default: 2 x cores)')
+    workerpool_parser.add_argument('--requests', type=int, default=64)
+    workerpool_parser.set_defaults(func=bench_workerpool)
+
+    encoders_parser = subparsers.add_parser('encoders', help='encode time and bytes per encoder profile')
+    encoders_parser.add_argument('--megapixels', type=float, nargs='+', default=[1, 4, 12, 25])
+    encoders_parser.add_argument('--images', nargs='+', default=None, help='image files to use instead of the synthetic corpus')
+    encoders_parser.add_argument('--profiles', nargs='+', default=None, help='profiles to run (default: all)')
+    encoders_parser.add_argument('--repeats', type=int, default=2)
+    encoders_parser.set_defaults(func=bench_encoders)
+
+    startup_parser = subparsers.add_parser('startup', help='time to /health and to the first preview per STARTUP_MODE')
+    startup_parser.add_argument('--modes', nargs='+', default=['eager', 'staged'])
+    startup_parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for each server')
+    startup_parser.set_defaults(func=bench_startup)
+
+    int8_parser = subparsers.add_parser('int8', help='int8 vs fp32 preview masks on a local image set')
+    int8_parser.add_argument('--images', required=True, help='directory of test images')
+    int8_parser.add_argument('--variant', default='birefnet-int8', help='quantized variant (see quantized_models.py)')
+    int8_parser.add_argument('--size', type=int, default=512, help='longest side images are scaled to (preview size)')
+    int8_parser.add_argument('--min-iou', type=float, default=0.97)
+    int8_parser.add_argument('--max-edge-mae', type=float, default=12.0, help='max per-image edge-band alpha error (0-255)')
+    int8_parser.add_argument('--repeats', type=int, default=2)
+    int8_parser.set_defaults(func=bench_int8)
+
+    stagegraph_parser = subparsers.add_parser('stagegraph', help='premium stages: sequential vs concurrent stage graph')
+    stagegraph_parser.add_argument('--semantic-model', default='birefnet')
+    stagegraph_parser.add_argument('--matting-model', default='silueta')
+    stagegraph_parser.add_argument('--megapixels', type=float, nargs='+', default=[2, 4, 8])
+    stagegraph_parser.add_argument('--workers', type=int, default=4)
+    stagegraph_parser.add_argument('--repeats', type=int, default=2)
+    stagegraph_parser.set_defaults(func=bench_stagegraph)
+
+    docfastpath_parser = subparsers.add_parser('docfastpath', help='classical document masks vs the model')
+    docfastpath_parser.add_argument('--images', required=True, help='directory of document images')
+    docfastpath_parser.add_argument('--model', default='birefnet', help='model the fast path replaces')
+    docfastpath_parser.add_argument('--min-confidence', type=float, default=0.8)
+    docfastpath_parser.add_argument('--repeats', type=int, default=2)
+    docfastpath_parser.set_defaults(func=bench_docfastpath)
+
+    analysis_parser = subparsers.add_parser('analysis', help='pre-inference analysis: full resolution vs downsampled')
+    analysis_parser.add_argument('--megapixels', type=float, nargs='+', default=[1, 4, 12, 25])
+    analysis_parser.add_argument('--repeats', type=int, default=3)
+    analysis_parser.set_defaults(func=bench_analysis)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Sampled Debug-Artifact Capture for Background Removal
+Mask statistics and intermediate masks of a sample of requests (or of any request sent
+with the capture header), kept in a size-bounded in-memory ring buffer. Requests that
+aren't captured pay nothing: no statistics, no copies, no PNG encodes.
+"""
+
+import io
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Share of requests captured (0-1) per pipeline; DEBUG_CAPTURE_SAMPLE_RATE is the default for all
+DEBUG_CAPTURE_SAMPLE_RATE = float(os.environ.get('DEBUG_CAPTURE_SAMPLE_RATE', '0'))
+DEBUG_CAPTURE_SAMPLE_RATES = {
+    'free_preview': float(os.environ.get('DEBUG_CAPTURE_SAMPLE_RATE_PREVIEW', DEBUG_CAPTURE_SAMPLE_RATE)),
+    'premium': float(os.environ.get('DEBUG_CAPTURE_SAMPLE_RATE_PREMIUM', DEBUG_CAPTURE_SAMPLE_RATE)),
+}
+# Ring buffer bounds: memory (MB of artifact pixels) and number of captures (0 MB = capture off)
+DEBUG_CAPTURE_MAX_MB = float(os.environ.get('DEBUG_CAPTURE_MAX_MB', '64'))
+DEBUG_CAPTURE_MAX_ENTRIES = int(os.environ.get('DEBUG_CAPTURE_MAX_ENTRIES', '50'))
+# Request header that forces a capture: its value must match DEBUG_CAPTURE_TOKEN, which also
+# guards the capture endpoints. With no token set the header is ignored and the endpoints are closed
+DEBUG_CAPTURE_HEADER = 'X-Debug-Capture'
+DEBUG_CAPTURE_TOKEN = os.environ.get('DEBUG_CAPTURE_TOKEN', '')
+
+_local = threading.local()
+
+
+def header_enables_capture(value):
+    """Whether an X-Debug-Capture header value forces a capture (never without a token)"""
+    return bool(DEBUG_CAPTURE_TOKEN) and value == DEBUG_CAPTURE_TOKEN
+
+
+class Capture:
+    """Mask statistics and artifacts (uint8 arrays, encoded only when read) of one request"""
+
+    def __init__(self, pipeline, reason):
+        self.id = uuid.uuid4().hex[:16]
+        self.pipeline = pipeline
+        self.reason = reason  # 'header' | 'sampled'
+        self.created_at = time.time()
+        self.stats = {}
+        self.artifacts = OrderedDict()  # name -> HxW uint8 array
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.artifacts.values())
+
+    def mask_stats(self, tag, mask):
+        arr = np.asarray(mask.convert('L') if isinstance(mask, Image.Image) else mask)
+        self.stats.update({
+            f"{tag}_min": float(arr.min()) if arr.size else 0.0,
+            f"{tag}_max": float(arr.max()) if arr.size else 0.0,
+            f"{tag}_shape": arr.shape,
+            f"{tag}_dtype": str(arr.dtype),
+            f"{tag}_nonzero": int(np.count_nonzero(arr)),
+        })
+
+    def artifact(self, name, mask):
+        # Copy: the pipeline keeps modifying its buffers after the checkpoint
+        arr = np.asarray(mask.convert('L') if isinstance(mask, Image.Image) else mask)
+        self.artifacts[name] = np.array(arr, dtype=np.uint8, copy=True)
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'pipeline': self.pipeline,
+            'reason': self.reason,
+            'createdAt': round(self.created_at, 3),
+            'artifacts': list(self.artifacts),
+            'memoryMB': round(self.nbytes / (1024 * 1024), 2),
+        }
+
+
+class CaptureStore:
+    """Ring buffer of finished captures: oldest dropped first past the byte or entry bound"""
+
+    def __init__(self, memory_mb=DEBUG_CAPTURE_MAX_MB, max_entries=DEBUG_CAPTURE_MAX_ENTRIES,
+                 sample_rates=None):
+        self._budget = int(memory_mb * 1024 * 1024)
+        self._max_entries = max_entries
+        self._sample_rates = dict(DEBUG_CAPTURE_SAMPLE_RATES, **(sample_rates or {}))
+        self._entries = OrderedDict()  # capture id -> Capture
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'sampled': 0, 'forced': 0, 'stored': 0, 'evicted': 0, 'too_large': 0}
+
+    @property
+    def enabled(self):
+        return self._budget > 0 and self._max_entries > 0
+
+    def should_capture(self, pipeline, header_value=None):
+        """'header', 'sampled' or None (no capture) for a new request"""
+        if not self.enabled:
+            return None
+        if header_enables_capture(header_value):
+            return 'header'
+        rate = self._sample_rates.get(pipeline, DEBUG_CAPTURE_SAMPLE_RATE)
+        if rate > 0 and random.random() < rate:
+            return 'sampled'
+        return None
+
+    def add(self, capture):
+        size = capture.nbytes
+        with self._lock:
+            self._counters['forced' if capture.reason == 'header' else 'sampled'] += 1
+            if size > self._budget:
+                self._counters['too_large'] += 1
+                return False
+            self._entries[capture.id] = capture
+            self._bytes += size
+            self._counters['stored'] += 1
+            while self._entries and (self._bytes > self._budget or len(self._entries) > self._max_entries):
+                _, oldest = self._entries.popitem(last=False)
+                self._bytes -= oldest.nbytes
+                self._counters['evicted'] += 1
+        return True
+
+    def get(self, capture_id):
+        with self._lock:
+            return self._entries.get(capture_id)
+
+    def list(self):
+        """Summaries of the stored captures, newest first"""
+        with self._lock:
+            captures = list(self._entries.values())
+        return [capture.summary() for capture in reversed(captures)]
+
+    def artifact_png(self, capture_id, name):
+        """PNG bytes of one artifact, or None if the capture or artifact is gone"""
+        capture = self.get(capture_id)
+        arr = capture.artifacts.get(name) if capture is not None else None
+        if arr is None:
+            return None
+        buffer = io.BytesIO()
+        Image.fromarray(arr, mode='L').save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                'enabled': self.enabled,
+                'sample_rates': self._sample_rates,
+                'entries': len(self._entries),
+                'max_entries': self._max_entries,
+                'memory_mb': round(self._bytes / (1024 * 1024), 1),
+                'memory_budget_mb': round(self._budget / (1024 * 1024), 1),
+            }
+
+
+capture_store = CaptureStore()
+
+
+def begin_capture(pipeline, header_value=None):
+    """Start capturing the current request (thread-local) if forced or sampled; returns the capture or None"""
+    reason = capture_store.should_capture(pipeline, header_value)
+    _local.capture = Capture(pipeline, reason) if reason else None
+    return _local.capture
+
+
+def current_capture():
+    return getattr(_local, 'capture', None)
+
+
+def capture_mask_stats(tag, mask):
+    """Record min/max/shape/dtype/nonzero of a mask under `tag` (no-op when not capturing)"""
+    capture = current_capture()
+    if capture is None:
+        return
+    try:
+        capture.mask_stats(tag, mask)
+    except Exception as e:
+        logger.warning(f"Debug capture of {tag} stats failed: {e}")
+
+
+def capture_artifact(name, mask):
+    """Keep a copy of a mask as artifact `name` (no-op when not capturing)"""
+    capture = current_capture()
+    if capture is None:
+        return
+    try:
+        capture.artifact(name, mask)
+    except Exception as e:
+        logger.warning(f"Debug capture of {name} failed: {e}")
+
+
+def end_capture(debug_stats=None):
+    """
+    Finish the current capture and store it in the ring buffer; its stats and id go into
+    debug_stats (under 'debug_capture'). Returns the capture id, or None when not capturing.
+    """
+    capture = current_capture()
+    _local.capture = None
+    if capture is None:
+        return None
+    stored = capture_store.add(capture)
+    logger.info(f"🔬 Debug capture {capture.id} ({capture.reason}): {len(capture.artifacts)} artifacts, "
+                f"{capture.nbytes / 1024:.0f} KB{'' if stored else ' - over the buffer budget, dropped'}")
+    if debug_stats is not None:
+        debug_stats['debug_capture'] = dict(capture.stats, id=capture.id, reason=capture.reason, stored=stored)
+    return capture.id if stored else None
+
+
+def discard_capture():
+    """Drop an unfinished capture (errors, cache hits) so it can't leak into the next request"""
+    _local.capture = None
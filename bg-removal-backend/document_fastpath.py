@@ -0,0 +1,161 @@
+"""
+Classical Document Segmentation Fast Path for Background Removal
+Plain-paper documents (scans, pages and ID cards on a darker surface) are segmented
+without a neural model, on the downsampled analysis copy: threshold the paper, take the
+largest page contour, clean it up morphologically. A confidence gate sends anything that
+doesn't look like a clean page back to the model.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from image_analysis import ImageAnalysis
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+# Fast path on/off (1 = on; needs OpenCV)
+DOCUMENT_FAST_PATH = os.environ.get('DOCUMENT_FAST_PATH', '1') == '1'
+# Below this confidence (0-1) the document goes to the model instead
+DOCUMENT_FAST_PATH_MIN_CONFIDENCE = float(os.environ.get('DOCUMENT_FAST_PATH_MIN_CONFIDENCE', '0.8'))
+# A page covering at least this share of the frame is treated as a full-frame scan
+FULL_FRAME_FRACTION = 0.97
+# Smallest page (share of the frame) the fast path accepts
+MIN_PAGE_FRACTION = 0.2
+
+
+def segment_document(analysis):
+    """
+    Page mask of a document image from its ImageAnalysis -> (mask, confidence, stats).
+    mask is uint8 0/255 at the analysis size (None if no page was found); confidence
+    combines page coverage, rectangularity, paper brightness and page/background contrast.
+    """
+    gray = analysis.gray
+    height, width = gray.shape
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+
+    # Paper vs background: global Otsu, plus a local-mean (adaptive) threshold so shadowed
+    # parts of the page that fall below the global split still count as paper
+    _, paper = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    block = max(3, (max(height, width) // 8) | 1)
+    local = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block, -5)
+    paper = cv2.bitwise_or(paper, cv2.bitwise_and(local, cv2.dilate(paper, np.ones((9, 9), np.uint8))))
+
+    # Close text and lines into solid paper, then drop specks
+    kernel_size = max(3, (max(height, width) // 50) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+    paper = cv2.morphologyEx(paper, cv2.MORPH_CLOSE, kernel)
+    paper = cv2.morphologyEx(paper, cv2.MORPH_OPEN, kernel)
+
+    contours, _ = cv2.findContours(paper, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None, 0.0, {'reason': 'no_page_contour'}
+    page = max(contours, key=cv2.contourArea)
+    page_area = cv2.contourArea(page)
+    coverage = page_area / float(height * width)
+
+    # Pages are quadrilaterals: fill the 4-corner approximation when there is one
+    approx = cv2.approxPolyDP(page, 0.02 * cv2.arcLength(page, True), True)
+    polygon = approx if len(approx) == 4 else cv2.convexHull(page)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.fillPoly(mask, [polygon], 255)
+
+    (_, _), (rect_w, rect_h), _ = cv2.minAreaRect(page)
+    rectangularity = page_area / max(1.0, rect_w * rect_h)
+    inside = mask > 0
+    paper_brightness = float(gray[inside].mean()) if inside.any() else 0.0
+    full_frame = coverage >= FULL_FRAME_FRACTION
+    contrast = 255.0 if full_frame else (paper_brightness - float(gray[~inside].mean()) if (~inside).any() else 0.0)
+
+    scores = {
+        'coverage': 0.0 if coverage < MIN_PAGE_FRACTION else min(1.0, coverage / 0.4),
+        'rectangularity': 1.0 if full_frame else float(np.clip((rectangularity - 0.7) / 0.25, 0.0, 1.0)),
+        'paper_brightness': float(np.clip((paper_brightness - 120.0) / 60.0, 0.0, 1.0)),
+        'contrast': float(np.clip(contrast / 40.0, 0.0, 1.0)),
+    }
+    confidence = min(scores.values())
+    stats = {
+        'page_coverage': round(coverage, 3),
+        'page_corners': int(len(approx)),
+        'rectangularity': round(float(rectangularity), 3),
+        'paper_brightness': round(paper_brightness, 1),
+        'contrast': round(float(contrast), 1),
+        'full_frame': bool(full_frame),
+        'scores': {name: round(value, 3) for name, value in scores.items()},
+    }
+    if full_frame:
+        mask[:] = 255  # Scan: the whole frame is the page
+    return mask, confidence, stats
+
+
+def upscale_mask(mask, size):
+    """Binary mask to `size` (width, height): linear upscale re-thresholded, so the page edge stays crisp"""
+    if (mask.shape[1], mask.shape[0]) == tuple(size):
+        return mask
+    resized = cv2.resize(mask, tuple(size), interpolation=cv2.INTER_LINEAR)
+    return np.where(resized >= 128, 255, 0).astype(np.uint8)
+
+
+class DocumentFastPath:
+    """Confidence-gated classical segmentation for detected documents, with take-rate counters"""
+
+    def __init__(self, enabled=DOCUMENT_FAST_PATH, min_confidence=DOCUMENT_FAST_PATH_MIN_CONFIDENCE):
+        self.enabled = enabled and CV2_AVAILABLE
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self._counters = {'attempts': 0, 'taken': 0, 'gated': 0, 'errors': 0, 'fast_path_ms_total': 0.0}
+
+    def try_segment(self, rgb, debug_stats=None, analysis=None):
+        """
+        uint8 0/255 mask at the size of `rgb`, or None (off, low confidence or error: use the model).
+        analysis: the request's ImageAnalysis (built from rgb if not given).
+        The decision and its scores go into debug_stats['document_fast_path'].
+        """
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        try:
+            mask, confidence, stats = segment_document(analysis or ImageAnalysis.from_image(rgb))
+            accepted = mask is not None and confidence >= self.min_confidence
+            if accepted:
+                mask = upscale_mask(mask, (rgb.shape[1], rgb.shape[0]))
+        except Exception as e:
+            logger.warning(f"Document fast path failed, using the model: {e}")
+            with self._lock:
+                self._counters['attempts'] += 1
+                self._counters['errors'] += 1
+            return None
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        with self._lock:
+            self._counters['attempts'] += 1
+            self._counters['taken' if accepted else 'gated'] += 1
+            self._counters['fast_path_ms_total'] += elapsed_ms
+        if debug_stats is not None:
+            debug_stats['document_fast_path'] = dict(stats, taken=accepted, confidence=round(confidence, 3),
+                                                     ms=round(elapsed_ms, 2))
+        logger.info(f"📄 Document fast path {'taken' if accepted else 'gated'}: confidence {confidence:.2f} "
+                    f"(min {self.min_confidence:g}) in {elapsed_ms:.1f}ms")
+        return mask if accepted else None
+
+    def stats(self):
+        with self._lock:
+            attempts = self._counters['attempts']
+            return {
+                'enabled': self.enabled,
+                'min_confidence': self.min_confidence,
+                'attempts': attempts,
+                'taken': self._counters['taken'],
+                'gated': self._counters['gated'],
+                'errors': self._counters['errors'],
+                'take_rate': round(self._counters['taken'] / attempts, 3) if attempts else 0.0,
+                'mean_ms': round(self._counters['fast_path_ms_total'] / attempts, 2) if attempts else 0.0,
+            }
@@ -0,0 +1,134 @@
+"""
+Downsampled Image Analysis for Background Removal
+One small copy of an upload (JPEG: decoded straight at reduced DCT scale) plus the
+features computed on it once - grayscale, brightness, contrast, edge density - shared by
+every pre-inference classifier, so their cost doesn't grow with the upload size.
+"""
+
+import io
+import logging
+import math
+import os
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+# Longest side of the analysis copy (pixels)
+IMAGE_ANALYSIS_SIZE = int(os.environ.get('IMAGE_ANALYSIS_SIZE', '1024'))
+
+
+def _reduce_to(image, max_side):
+    """Integer box reduction (Image.reduce) until the longest side fits max_side"""
+    factor = int(math.ceil(max(image.size) / float(max_side)))
+    return image.reduce(factor) if factor > 1 else image
+
+
+def _to_rgb(image):
+    """RGB copy of a PIL image; transparency is flattened onto white like the request decode"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB') if image.mode != 'RGB' else image
+
+
+class ImageAnalysis:
+    """
+    Small RGB copy of an image (longest side <= IMAGE_ANALYSIS_SIZE) and lazily computed
+    features on it. source_size is the full image's (width, height), for aspect-ratio checks.
+    """
+
+    def __init__(self, rgb, source_size, method):
+        self.rgb = rgb
+        self.source_size = source_size
+        self.method = method  # 'jpeg_draft' | 'reduce'
+        self._gray = None
+        self._edge_density = None
+
+    @classmethod
+    def from_image(cls, image):
+        """From a decoded PIL image or HxW(x3) array"""
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(image)
+        small = _to_rgb(_reduce_to(image, IMAGE_ANALYSIS_SIZE))
+        return cls(np.asarray(small), image.size, 'reduce')
+
+    @classmethod
+    def from_encoded(cls, source):
+        """
+        From encoded bytes or a seekable stream, decoding JPEGs at 1/2-1/8 DCT scale (draft mode).
+        Returns None for other formats or unreadable input: use from_image on the decoded image.
+        The stream is read from its start and left at its start.
+        """
+        stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+        try:
+            stream.seek(0)
+            image = Image.open(stream)
+            if image.format != 'JPEG':
+                return None
+            width, height = image.size
+            scale = IMAGE_ANALYSIS_SIZE / float(max(width, height))
+            if scale < 1.0:
+                image.draft('RGB', (int(math.ceil(width * scale)), int(math.ceil(height * scale))))
+            small = _to_rgb(_reduce_to(image, IMAGE_ANALYSIS_SIZE))
+            return cls(np.asarray(small), (width, height), 'jpeg_draft')
+        except Exception as e:
+            logger.debug(f"Draft analysis decode failed, falling back to the decoded image: {e}")
+            return None
+        finally:
+            try:
+                stream.seek(0)
+            except Exception:
+                pass
+
+    @property
+    def aspect_ratio(self):
+        width, height = self.source_size
+        return width / height if height > 0 else 1.0
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            if CV2_AVAILABLE:
+                self._gray = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+            else:
+                self._gray = np.mean(self.rgb, axis=2).astype(np.uint8)
+        return self._gray
+
+    @property
+    def brightness(self):
+        """Mean of all channels, 0-1"""
+        return float(np.mean(self.rgb, dtype=np.float64)) / 255.0
+
+    @property
+    def gray_std(self):
+        return float(np.std(self.gray))
+
+    @property
+    def edge_density(self):
+        """Share of edge pixels: Canny (50/150), or Sobel magnitude > 30 without OpenCV"""
+        if self._edge_density is None:
+            if CV2_AVAILABLE:
+                edges = cv2.Canny(self.gray, 50, 150)
+                self._edge_density = float(np.count_nonzero(edges)) / edges.size
+            else:
+                from scipy import ndimage
+                gray = self.gray.astype(np.float32)
+                magnitude = np.hypot(ndimage.sobel(gray, axis=1), ndimage.sobel(gray, axis=0))
+                self._edge_density = float(np.count_nonzero(magnitude > 30)) / magnitude.size
+        return self._edge_density
+
+
+def analyze(image, encoded=None):
+    """Analysis of a decoded image; `encoded` (bytes or stream of the same upload) enables the JPEG draft path"""
+    analysis = ImageAnalysis.from_encoded(encoded) if encoded is not None else None
+    return analysis or ImageAnalysis.from_image(image)
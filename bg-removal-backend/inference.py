@@ -0,0 +1,186 @@
+"""
+In-Memory Inference Layer for Background Removal
+Feeds uint8/float32 image arrays straight to a rembg session's ONNX Runtime
+session and returns the mask as a uint8 array - no PNG encode/decode round-trips.
+"""
+
+import logging
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+# Preprocessing spec per rembg model name: input size (w, h), mean, std, sigmoid on output.
+# Mirrors the normalize()/predict() pairs of the rembg session classes so masks match remove().
+MODEL_SPECS = {
+    'birefnet': {'size': (1024, 1024), 'mean': IMAGENET_MEAN, 'std': IMAGENET_STD, 'sigmoid': True},
+    'birefnet-general': {'size': (1024, 1024), 'mean': IMAGENET_MEAN, 'std': IMAGENET_STD, 'sigmoid': True},
+    'birefnet-general-lite': {'size': (1024, 1024), 'mean': IMAGENET_MEAN, 'std': IMAGENET_STD, 'sigmoid': True},
+    'birefnet-portrait': {'size': (1024, 1024), 'mean': IMAGENET_MEAN, 'std': IMAGENET_STD, 'sigmoid': True},
+    'birefnet-massive': {'size': (1024, 1024), 'mean': IMAGENET_MEAN, 'std': IMAGENET_STD, 'sigmoid': True},
+    'u2net': {'size': (320, 320), 'mean': IMAGENET_MEAN, 'std': IMAGENET_STD, 'sigmoid': False},
+    'u2netp': {'size': (320, 320), 'mean': IMAGENET_MEAN, 'std': IMAGENET_STD, 'sigmoid': False},
+    'u2net_human_seg': {'size': (320, 320), 'mean': IMAGENET_MEAN, 'std': IMAGENET_STD, 'sigmoid': False},
+    'silueta': {'size': (320, 320), 'mean': IMAGENET_MEAN, 'std': IMAGENET_STD, 'sigmoid': False},
+    'isnet-general-use': {'size': (1024, 1024), 'mean': (0.5, 0.5, 0.5), 'std': (1.0, 1.0, 1.0), 'sigmoid': False},
+    'bria-rmbg': {'size': (1024, 1024), 'mean': (0.5, 0.5, 0.5), 'std': (1.0, 1.0, 1.0), 'sigmoid': False},
+}
+
+
+def get_model_spec(session):
+    """Return the preprocessing spec for a rembg session, or None if it must use session.predict()"""
+    if not hasattr(session, 'inner_session'):
+        return None
+    # Key on the session class: rembg builds a U2netSession for unknown model names.
+    # name() is a classmethod on rembg sessions; pool stand-ins forward their worker's class name
+    try:
+        class_name = session.name()
+    except Exception:
+        class_name = getattr(session, 'model_name', None)
+    return MODEL_SPECS.get(class_name)
+
+
+def to_rgb_array(image):
+    """
+    Return a contiguous HxWx3 RGB array for a PIL image or ndarray.
+    uint8 arrays are returned as-is (no copy); float arrays are kept in [0, 1].
+    """
+    if isinstance(image, Image.Image):
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.asarray(image)
+    if image.ndim == 2:
+        image = np.stack([image] * 3, axis=2)
+    elif image.shape[2] == 4:
+        image = image[:, :, :3]
+    return np.ascontiguousarray(image)
+
+
+def _resize(array, size, interpolation='lanczos'):
+    """
+    Resize an HxW or HxWxC array to size (w, h).
+    uint8 goes through PIL so masks match rembg's own (antialiased) LANCZOS resize exactly.
+    """
+    if (array.shape[1], array.shape[0]) == tuple(size):
+        return array
+    resample = Image.Resampling.LANCZOS if interpolation == 'lanczos' else Image.Resampling.BILINEAR
+    if array.dtype == np.uint8:
+        return np.array(Image.fromarray(array).resize(tuple(size), resample))
+    array = array.astype(np.float32)
+    if CV2_AVAILABLE:
+        flag = cv2.INTER_AREA if size[0] < array.shape[1] else cv2.INTER_LANCZOS4
+        if interpolation != 'lanczos':
+            flag = cv2.INTER_LINEAR
+        return cv2.resize(array, tuple(size), interpolation=flag)
+    # Float input: PIL only resizes single-channel float images ('F' mode)
+    if array.ndim == 2:
+        return np.asarray(Image.fromarray(array, mode='F').resize(tuple(size), resample))
+    return np.stack([
+        np.asarray(Image.fromarray(array[:, :, c], mode='F').resize(tuple(size), resample))
+        for c in range(array.shape[2])
+    ], axis=2)
+
+
+def preprocess(rgb, spec):
+    """
+    Normalize an RGB array into the 1x3xHxW float32 tensor the model expects.
+    Same math as rembg BaseSession.normalize (divide by max, then mean/std).
+    """
+    resized = _resize(rgb, spec['size']).astype(np.float32)
+    peak = float(resized.max())
+    if peak > 0:
+        resized /= peak
+    resized -= np.asarray(spec['mean'], dtype=np.float32)
+    resized /= np.asarray(spec['std'], dtype=np.float32)
+    return np.expand_dims(resized.transpose((2, 0, 1)), 0)
+
+
+def postprocess(raw, output_size, spec):
+    """Convert a raw 1xHxW model output into a uint8 mask of output_size (w, h)"""
+    pred = raw.astype(np.float32)
+    if spec['sigmoid']:
+        pred = 1.0 / (1.0 + np.exp(-pred))
+    ma = float(pred.max())
+    mi = float(pred.min())
+    pred = (pred - mi) / (ma - mi) if ma > mi else np.zeros_like(pred)
+    mask = (np.squeeze(pred) * 255).astype(np.uint8)
+    return _resize(mask, output_size)
+
+
+def predict_mask(session, image, output_size=None):
+    """
+    Run a rembg session on an in-memory image and return the mask as uint8 HxW.
+
+    Args:
+        session: rembg session (from new_session)
+        image: PIL image, uint8 HxWx3 array, or float32 HxWx3 array in [0, 1]
+        output_size: (w, h) of the returned mask; defaults to the input size
+
+    Sessions without a known spec fall back to session.predict(), which is still
+    in-memory (PIL) and avoids the PNG round-trip of rembg.remove(bytes).
+    """
+    rgb = to_rgb_array(image)
+    if output_size is None:
+        output_size = (rgb.shape[1], rgb.shape[0])
+
+    spec = get_model_spec(session)
+    if spec is None:
+        if rgb.dtype != np.uint8:
+            rgb = (np.clip(rgb, 0, 1) * 255).astype(np.uint8)
+        mask = session.predict(Image.fromarray(rgb, mode='RGB'))[0]
+        return _resize(np.array(mask.convert('L')), output_size)
+
+    inner = session.inner_session
+    tensor = preprocess(rgb, spec)
+    raw = inner.run(None, {inner.get_inputs()[0].name: tensor})[0][:, 0, :, :]
+    return postprocess(raw, output_size, spec)
+
+
+def supports_batching(session):
+    """True if the session's ONNX input has a dynamic (or >1) batch dimension"""
+    if get_model_spec(session) is None:
+        return False
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    return not isinstance(batch_dim, int) or batch_dim > 1
+
+
+def predict_masks(session, images, output_sizes=None):
+    """
+    Batched predict_mask: stack all images into one ONNX run and split the masks back out.
+    Falls back to one run per image when the model has a fixed batch size of 1.
+    """
+    if output_sizes is None:
+        output_sizes = [None] * len(images)
+    if len(images) == 1 or not supports_batching(session):
+        return [predict_mask(session, image, size) for image, size in zip(images, output_sizes)]
+
+    spec = get_model_spec(session)
+    rgbs = [to_rgb_array(image) for image in images]
+    batch = np.concatenate([preprocess(rgb, spec) for rgb in rgbs], axis=0)
+    inner = session.inner_session
+    raw = inner.run(None, {inner.get_inputs()[0].name: batch})[0][:, 0, :, :]
+    masks = []
+    for i, rgb in enumerate(rgbs):
+        size = output_sizes[i] or (rgb.shape[1], rgb.shape[0])
+        masks.append(postprocess(raw[i:i + 1], size, spec))
+    return masks
+
+
+def cutout_rgba(image, mask):
+    """
+    Build the RGBA cutout rembg.remove() would have returned (naive cutout).
+    Used only by fallback paths that need the raw model output image.
+    """
+    rgb = image if isinstance(image, Image.Image) else Image.fromarray(to_rgb_array(image))
+    mask_img = mask if isinstance(mask, Image.Image) else Image.fromarray(mask, mode='L')
+    empty = Image.new('RGBA', rgb.size, 0)
+    return Image.composite(rgb.convert('RGBA'), empty, mask_img)
@@ -0,0 +1,240 @@
+"""
+Inference Worker Pool for Background Removal
+A fixed set of inference workers, each owning its own ONNX Runtime sessions with
+pinned intra-op/inter-op thread counts; ONNX runs reach them through a bounded queue.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from model_registry import ModelRegistry
+from quantized_models import is_quantized_variant, load_quantized_session
+
+logger = logging.getLogger(__name__)
+
+# Pool layout: '' / 'off' = shared sessions (no pool), 'auto' = pick from the core count,
+# or an explicit '<workers>x<threads>' split such as '2x4'
+INFERENCE_POOL = os.environ.get('INFERENCE_POOL', '').strip().lower()
+# Pending ONNX runs allowed in the queue, and how long a request waits for a slot (seconds)
+INFERENCE_POOL_QUEUE_SIZE = int(os.environ.get('INFERENCE_POOL_QUEUE_SIZE', '16'))
+INFERENCE_POOL_QUEUE_TIMEOUT = float(os.environ.get('INFERENCE_POOL_QUEUE_TIMEOUT', '30'))
+# 'auto' never gives one worker more intra-op threads than this (conv nets stop scaling)
+INFERENCE_POOL_MAX_THREADS_PER_WORKER = int(os.environ.get('INFERENCE_POOL_MAX_THREADS_PER_WORKER', '4'))
+
+
+class InferencePoolBusy(RuntimeError):
+    """The inference queue stayed full for longer than the queue timeout"""
+
+
+def available_cores():
+    """CPUs this process may use: scheduler affinity, capped by a cgroup v2 CPU quota"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            cores = min(cores, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cores)
+
+
+def choose_layout(cores, max_threads_per_worker=INFERENCE_POOL_MAX_THREADS_PER_WORKER):
+    """
+    Default workers x threads split: give each worker as many intra-op threads as still
+    scale (up to max_threads_per_worker), then use the remaining cores for more workers.
+    """
+    threads = max(1, min(cores, max_threads_per_worker))
+    return max(1, cores // threads), threads
+
+
+def parse_layout(value, cores=None):
+    """'auto' or '<workers>x<threads>' -> (workers, threads); None when the pool is off"""
+    if value in ('', 'off', '0', 'none'):
+        return None
+    if value == 'auto':
+        return choose_layout(cores or available_cores())
+    try:
+        workers, threads = (int(part) for part in value.split('x'))
+    except ValueError:
+        raise ValueError(f"INFERENCE_POOL must be 'auto' or '<workers>x<threads>', got '{value}'")
+    if workers < 1 or threads < 1:
+        raise ValueError(f"INFERENCE_POOL needs at least 1 worker and 1 thread, got '{value}'")
+    return workers, threads
+
+
+def pinned_session_factory(threads, spin=True):
+    """rembg session factory with fixed intra-op threads and a single inter-op thread"""
+    def factory(model_name):
+        import onnxruntime as ort
+        from rembg.sessions import sessions_class
+        from rembg.sessions.u2net import U2netSession
+
+        session_class = next((sc for sc in sessions_class if sc.name() == model_name), U2netSession)
+        sess_opts = ort.SessionOptions()
+        sess_opts.intra_op_num_threads = threads
+        sess_opts.inter_op_num_threads = 1
+        sess_opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if not spin:
+            # Idle workers must not busy-wait on cores that other workers are using
+            sess_opts.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        if is_quantized_variant(model_name):
+            return load_quantized_session(model_name, sess_opts)
+        return session_class(model_name, sess_opts)
+    return factory
+
+
+class _PooledInnerSession:
+    """Stand-in for onnxruntime.InferenceSession: run() executes on a pool worker"""
+
+    def __init__(self, pool, model_name, inputs):
+        self._pool = pool
+        self._model_name = model_name
+        self._inputs = inputs
+
+    def get_inputs(self):
+        return self._inputs
+
+    def run(self, output_names, input_feed, run_options=None):
+        return self._pool.call(self._model_name,
+                               lambda session: session.inner_session.run(output_names, input_feed, run_options))
+
+
+class PooledSession:
+    """
+    Stand-in for a rembg session, usable with predict_mask()/predict_masks()/the micro-batcher.
+    Model metadata comes from a worker's copy; every inference call is queued to the pool.
+    """
+
+    def __init__(self, pool, model_name):
+        self._pool = pool
+        self.model_name = model_name
+        self._class_name, inputs = pool.call(
+            model_name, lambda session: (session.name(), session.inner_session.get_inputs()))
+        self.inner_session = _PooledInnerSession(pool, model_name, inputs)
+
+    def name(self):
+        return self._class_name
+
+    def predict(self, img, *args, **kwargs):
+        return self._pool.call(self.model_name, lambda session: session.predict(img, *args, **kwargs))
+
+
+class InferencePool:
+    """
+    Worker threads, one private ModelRegistry each (sessions built with pinned thread counts).
+    ONNX Runtime releases the GIL inside run(), so workers execute concurrently; the pinned
+    counts keep workers x threads within the host's cores instead of oversubscribing them.
+    """
+
+    def __init__(self, workers, threads, queue_size=INFERENCE_POOL_QUEUE_SIZE,
+                 queue_timeout=INFERENCE_POOL_QUEUE_TIMEOUT, session_factory=None):
+        self.workers = workers
+        self.threads = threads
+        self.queue_timeout = queue_timeout
+        factory = session_factory or pinned_session_factory(threads, spin=workers == 1)
+        self._registries = [ModelRegistry(session_factory=factory) for _ in range(workers)]
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._busy = [False] * workers
+        self._completed = 0
+        self._rejected = 0
+        self._wait_seconds = 0.0
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._run, args=(index,), name=f'inference-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Inference pool: {workers} workers x {threads} intra-op threads, queue {queue_size}")
+
+    def call(self, model_name, fn):
+        """Run fn(session) on the next free worker's session for model_name and return its result"""
+        future = Future()
+        try:
+            self._queue.put((model_name, fn, future, time.monotonic()), timeout=self.queue_timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            raise InferencePoolBusy(f"Inference queue full ({self._queue.maxsize} pending) for {self.queue_timeout:g}s")
+        return future.result()
+
+    def _run(self, index):
+        registry = self._registries[index]
+        while True:
+            model_name, fn, future, queued_at = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._stats_lock:
+                self._busy[index] = True
+                self._wait_seconds += time.monotonic() - queued_at
+            try:
+                future.set_result(fn(registry.get(model_name)))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._stats_lock:
+                    self._busy[index] = False
+                    self._completed += 1
+
+    # ModelRegistry-compatible session getters
+
+    def get(self, model_name):
+        """Pool-backed session for model_name (one stand-in per model, so batchers can group on it)"""
+        with self._sessions_lock:
+            session = self._sessions.get(model_name)
+        if session is None:
+            session = PooledSession(self, model_name)
+            with self._sessions_lock:
+                session = self._sessions.setdefault(model_name, session)
+        return session
+
+    def get_first_available(self, model_names):
+        last_error = None
+        for model_name in model_names:
+            try:
+                return self.get(model_name)
+            except InferencePoolBusy:
+                raise
+            except Exception as e:
+                logger.warning(f"Model {model_name} not available: {e}")
+                last_error = e
+        raise RuntimeError(f"No model available from {model_names}: {last_error}")
+
+    def warm(self, model_name):
+        """Load model_name in every worker (startup), instead of on each worker's first request"""
+        for registry in self._registries:
+            registry.get(model_name)
+
+    def stats(self):
+        with self._stats_lock:
+            busy = sum(self._busy)
+            completed = self._completed
+            return {
+                'workers': self.workers,
+                'threads_per_worker': self.threads,
+                'busy_workers': busy,
+                'queued': self._queue.qsize(),
+                'queue_size': self._queue.maxsize,
+                'completed': completed,
+                'rejected': self._rejected,
+                'avg_queue_wait_ms': round(self._wait_seconds * 1000.0 / completed, 2) if completed else 0.0,
+                'worker_models': [sorted(registry.stats()['models']) for registry in self._registries],
+            }
+
+
+def create_inference_pool(layout=INFERENCE_POOL):
+    """InferencePool for the configured layout, or None when serving from shared sessions"""
+    parsed = parse_layout(layout)
+    if parsed is None:
+        return None
+    workers, threads = parsed
+    return InferencePool(workers, threads)
@@ -0,0 +1,194 @@
+"""
+Async Job Queue for Large Premium Requests
+Bounded local queue + worker threads: submit returns a job id at once, status reports the
+running stage, and finished results are kept on local disk until a TTL expires.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Where job inputs and results are written (stale job files are removed at startup: jobs don't survive a restart)
+PREMIUM_JOB_DIR = os.environ.get('PREMIUM_JOB_DIR', '/tmp/bg-removal-jobs')
+# How long finished jobs (and their results) are kept, in seconds
+PREMIUM_JOB_TTL_SECONDS = float(os.environ.get('PREMIUM_JOB_TTL_SECONDS', '3600'))
+# Jobs allowed to wait in the queue, and worker threads running them
+PREMIUM_JOB_QUEUE_SIZE = int(os.environ.get('PREMIUM_JOB_QUEUE_SIZE', '16'))
+PREMIUM_JOB_WORKERS = int(os.environ.get('PREMIUM_JOB_WORKERS', '1'))
+
+
+class JobQueueFull(RuntimeError):
+    """The job queue is at PREMIUM_JOB_QUEUE_SIZE"""
+
+
+class Job:
+    """One submitted request; `trace` is the StageTrace of the run (set by the run function)"""
+
+    def __init__(self, job_id, params, input_path):
+        self.id = job_id
+        self.params = params
+        self.input_path = input_path
+        self.result_path = None
+        self.state = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.trace = None
+        self.status_code = None
+        self.metadata = None
+        self.mime_type = None
+        self.error = None
+
+
+class JobManager:
+    """
+    Runs run_fn(job) -> (status_code, metadata, output_bytes, mime_type) on worker threads.
+    A 200 result is written to disk and the job is 'done'; anything else (or an exception)
+    marks it 'failed' with the metadata as its error payload.
+    """
+
+    def __init__(self, run_fn, job_dir=PREMIUM_JOB_DIR, ttl_seconds=PREMIUM_JOB_TTL_SECONDS,
+                 queue_size=PREMIUM_JOB_QUEUE_SIZE, workers=PREMIUM_JOB_WORKERS):
+        self._run_fn = run_fn
+        self.job_dir = job_dir
+        self.ttl_seconds = ttl_seconds
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected_full': 0, 'expired': 0}
+        os.makedirs(job_dir, exist_ok=True)
+        for name in os.listdir(job_dir):
+            if name.endswith(('.input', '.result', '.tmp')):
+                self._remove_file(os.path.join(job_dir, name))
+        for index in range(max(1, workers)):
+            threading.Thread(target=self._work, name=f'premium-job-{index}', daemon=True).start()
+        threading.Thread(target=self._reap, name='premium-job-reaper', daemon=True).start()
+        logger.info(f"Premium jobs: {workers} workers, queue {queue_size}, TTL {ttl_seconds:g}s in {job_dir}")
+
+    def submit(self, params, save_input):
+        """Queue a job; save_input(path) writes the upload to disk. Raises JobQueueFull."""
+        job_id = uuid.uuid4().hex
+        job = Job(job_id, params, os.path.join(self.job_dir, job_id + '.input'))
+        save_input(job.input_path)
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._counters['rejected_full'] += 1
+                full = True
+            else:
+                self._jobs[job_id] = job
+                self._counters['submitted'] += 1
+                full = False
+        if full:
+            self._remove_file(job.input_path)
+            raise JobQueueFull(f"Job queue full ({self._queue.maxsize} waiting)")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def read_result(self, job):
+        """Encoded output bytes of a finished job (None once expired)"""
+        try:
+            with open(job.result_path, 'rb') as f:
+                return f.read()
+        except (OSError, TypeError):
+            return None
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.started_at = time.time()
+            job.state = 'running'
+            try:
+                status_code, metadata, output_bytes, mime_type = self._run_fn(job)
+                if status_code == 200:
+                    result_path = os.path.join(self.job_dir, job.id + '.result')
+                    # Write-then-rename so the result endpoint never serves a partial file
+                    with open(result_path + '.tmp', 'wb') as f:
+                        f.write(output_bytes)
+                    os.replace(result_path + '.tmp', result_path)
+                    job.result_path, job.mime_type, job.metadata = result_path, mime_type, metadata
+                    job.state = 'done'
+                else:
+                    job.status_code, job.error = status_code, metadata
+                    job.state = 'failed'
+            except Exception as e:
+                logger.error(f"Premium job {job.id} failed: {e}", exc_info=True)
+                job.status_code = 500
+                job.error = {'success': False, 'error': 'Processing failed', 'message': str(e)}
+                job.state = 'failed'
+            finally:
+                job.finished_at = time.time()
+                self._remove_file(job.input_path)
+                with self._lock:
+                    self._counters['completed' if job.state == 'done' else 'failed'] += 1
+            logger.info(f"Premium job {job.id} {job.state} in {job.finished_at - job.started_at:.2f}s")
+
+    def _reap(self):
+        """Drop finished jobs (and their result files) once they are older than the TTL"""
+        interval = max(1.0, min(60.0, self.ttl_seconds / 4))
+        while True:
+            time.sleep(interval)
+            cutoff = time.time() - self.ttl_seconds
+            with self._lock:
+                expired = [job for job in self._jobs.values() if job.finished_at and job.finished_at < cutoff]
+                for job in expired:
+                    del self._jobs[job.id]
+                self._counters['expired'] += len(expired)
+            for job in expired:
+                if job.result_path:
+                    self._remove_file(job.result_path)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def status(self, job):
+        """Client-facing status: state, stage progress, queue position, timings"""
+        with self._lock:
+            position = None
+            if job.state == 'queued':
+                position = 1 + sum(1 for other in self._jobs.values()
+                                   if other.state == 'queued' and other.created_at < job.created_at)
+        trace = job.trace
+        completed = [entry['stage'] for entry in trace.stages] if trace else []
+        now = job.finished_at or time.time()
+        status = {
+            'jobId': job.id,
+            'state': job.state,
+            'currentStage': trace.active if trace and job.state == 'running' else None,
+            'lastCompletedStage': completed[-1] if completed else None,
+            'completedStages': completed,
+            'queuePosition': position,
+            'queuedSeconds': round((job.started_at or now) - job.created_at, 2),
+            'runningSeconds': round(now - job.started_at, 2) if job.started_at else None,
+        }
+        if job.finished_at:
+            status['expiresAt'] = round(job.finished_at + self.ttl_seconds, 0)
+        if job.state == 'failed':
+            status['error'] = job.error
+        return status
+
+    def stats(self):
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+            return {
+                'queued': states.count('queued'),
+                'running': states.count('running'),
+                'done': states.count('done'),
+                'failed': states.count('failed'),
+                'queue_size': self._queue.maxsize,
+                'ttl_seconds': self.ttl_seconds,
+                **self._counters,
+            }
@@ -0,0 +1,97 @@
+"""
+Short-Lived Mask Cache for Premium Re-Refinement
+Keeps the processing-size RGB and the raw model outputs (semantic mask, matting alpha)
+of recent premium runs, so a parameter tweak re-runs only post-processing and encode.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Memory budget in MB (0 = mask cache off)
+MASK_CACHE_MB = float(os.environ.get('MASK_CACHE_MB', '512'))
+# Seconds an entry stays usable after its last store or lookup
+MASK_CACHE_TTL_SECONDS = float(os.environ.get('MASK_CACHE_TTL_SECONDS', '600'))
+
+
+def _entry_bytes(entry):
+    return sum(value.nbytes for value in (entry['rgb'], entry['semantic'], entry.get('matting'))
+               if value is not None)
+
+
+class MaskCache:
+    """
+    LRU of mask entries keyed by mask id (the decoded image digest), bounded by a byte
+    budget and a TTL. An entry is a dict: 'rgb' (HxWx3 uint8 at processing size),
+    'semantic' (raw semantic mask), 'matting' (raw matting alpha or None), plus metadata.
+    Arrays are read-only to callers: the pipeline copies before modifying.
+    """
+
+    def __init__(self, memory_mb=MASK_CACHE_MB, ttl_seconds=MASK_CACHE_TTL_SECONDS):
+        self._budget = int(memory_mb * 1024 * 1024)
+        self._ttl = ttl_seconds
+        self._entries = OrderedDict()  # mask_id -> (entry, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0, 'evictions': 0}
+
+    @property
+    def enabled(self):
+        return self._budget > 0
+
+    def put(self, mask_id, entry):
+        size = _entry_bytes(entry)
+        if size > self._budget:
+            return False
+        with self._lock:
+            if mask_id in self._entries:
+                self._bytes -= self._entries.pop(mask_id)[1]
+            self._entries[mask_id] = (entry, size, time.monotonic() + self._ttl)
+            self._bytes += size
+            self._counters['stores'] += 1
+            self._evict(time.monotonic())
+        return True
+
+    def get(self, mask_id):
+        """Entry dict or None (unknown or expired); a hit extends the entry's TTL"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(mask_id)
+            if item is None:
+                self._counters['misses'] += 1
+                return None
+            entry, size, expires_at = item
+            if expires_at <= now:
+                del self._entries[mask_id]
+                self._bytes -= size
+                self._counters['expired'] += 1
+                return None
+            self._entries[mask_id] = (entry, size, now + self._ttl)
+            self._entries.move_to_end(mask_id)
+            self._counters['hits'] += 1
+            return entry
+
+    def _evict(self, now):
+        """Drop expired entries, then least recently used ones until under budget (lock held)"""
+        for mask_id in [key for key, (_, _, expires_at) in self._entries.items() if expires_at <= now]:
+            self._bytes -= self._entries.pop(mask_id)[1]
+            self._counters['expired'] += 1
+        while self._bytes > self._budget and self._entries:
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'memory_mb': round(self._bytes / (1024 * 1024), 1),
+                'memory_budget_mb': round(self._budget / (1024 * 1024), 1),
+                'ttl_seconds': self._ttl,
+            }
@@ -0,0 +1,227 @@
+"""
+Model Session Registry for Background Removal
+Loads each ONNX model once and shares it across all session getters, tracks
+resident memory per model, and unloads models that have been idle too long.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from quantized_models import is_quantized_variant, load_quantized_session
+
+logger = logging.getLogger(__name__)
+
+# Unload models idle for longer than this (seconds). 0 = never unload.
+MODEL_IDLE_UNLOAD_SECONDS = float(os.environ.get('MODEL_IDLE_UNLOAD_SECONDS', '0'))
+# Models that are never unloaded, comma-separated (e.g. the preview model)
+MODEL_PINNED = [m.strip() for m in os.environ.get('MODEL_PINNED', '').split(',') if m.strip()]
+# A failed load (e.g. download error) is retried after this many seconds
+MODEL_LOAD_RETRY_SECONDS = 60.0
+
+
+def read_rss_mb():
+    """Current resident set size of this process in MB (None if unavailable)"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def canonical_model_name(model_name):
+    """
+    Resolve the rembg session class a model name loads, so aliases share weights.
+    rembg falls back to U2netSession for unknown names, so those resolve to 'u2net'.
+    Quantized variants (quantized_models) are models of their own.
+    """
+    if is_quantized_variant(model_name):
+        return model_name
+    try:
+        from rembg.sessions import sessions_class
+    except ImportError:
+        return model_name
+    for session_class in sessions_class:
+        if session_class.name() == model_name:
+            return model_name
+    return 'u2net'
+
+
+def default_session_factory(model_name):
+    """rembg new_session, or the quantized ONNX file for a quantized variant name"""
+    if is_quantized_variant(model_name):
+        return load_quantized_session(model_name)
+    from rembg import new_session
+    return new_session(model_name)
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of rembg sessions keyed by canonical model name.
+    Thread-safe: concurrent getters for the same model wait for a single load.
+    """
+
+    def __init__(self, session_factory=None, idle_unload_seconds=MODEL_IDLE_UNLOAD_SECONDS, pinned=None):
+        # rembg (onnxruntime, pymatting) is imported on the first load, not when the app is imported
+        self._session_factory = session_factory
+        self._idle_unload_seconds = idle_unload_seconds
+        self._pinned_names = list(pinned if pinned is not None else MODEL_PINNED)
+        self._pinned = None
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._load_locks = {}
+        self._failed = {}
+        self._reaper = None
+        self._stop = threading.Event()
+
+    def get(self, model_name):
+        """Return the shared session for model_name, loading it on first use"""
+        key = canonical_model_name(model_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                failure = self._failed.get(key)
+                if failure and time.time() - failure['at'] < MODEL_LOAD_RETRY_SECONDS:
+                    raise RuntimeError(f"Model {model_name} failed to load: {failure['error']}")
+                load_lock = self._load_locks.setdefault(key, threading.Lock())
+        if entry is None:
+            # Per-model load lock: other models stay available while this one loads
+            with load_lock:
+                with self._lock:
+                    entry = self._entries.get(key)
+                if entry is None:
+                    entry = self._load(key)
+        with self._lock:
+            entry['last_used'] = time.time()
+            entry['uses'] += 1
+        self._ensure_reaper()
+        return entry['session']
+
+    def get_first_available(self, model_names):
+        """Return the first model in model_names that loads (fallback chains share weights)"""
+        last_error = None
+        for model_name in model_names:
+            try:
+                return self.get(model_name)
+            except Exception as e:
+                logger.warning(f"Model {model_name} not available: {e}")
+                last_error = e
+        raise RuntimeError(f"No model available from {model_names}: {last_error}")
+
+    def is_loaded(self, model_name):
+        with self._lock:
+            return canonical_model_name(model_name) in self._entries
+
+    def _load(self, key):
+        """Load a model; RSS delta is approximate if another model loads concurrently"""
+        logger.info(f"Loading model '{key}' into registry...")
+        rss_before = read_rss_mb()
+        start = time.time()
+        try:
+            if self._session_factory is None:
+                self._session_factory = default_session_factory
+            session = self._session_factory(key)
+        except Exception as e:
+            with self._lock:
+                self._failed[key] = {'error': str(e), 'at': time.time()}
+            raise
+        rss_after = read_rss_mb()
+        entry = {
+            'session': session,
+            'loaded_at': time.time(),
+            'load_seconds': time.time() - start,
+            'rss_mb': (rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+            'file_mb': self._model_file_mb(session),
+            'last_used': time.time(),
+            'uses': 0,
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._failed.pop(key, None)
+        logger.info(f"✅ Model '{key}' loaded in {entry['load_seconds']:.2f}s (RSS +{entry['rss_mb'] or 0:.1f} MB)")
+        return entry
+
+    @staticmethod
+    def _model_file_mb(session):
+        model_path = getattr(getattr(session, 'inner_session', None), '_model_path', None)
+        try:
+            return os.path.getsize(model_path) / (1024 * 1024) if model_path else None
+        except OSError:
+            return None
+
+    def unload(self, model_name):
+        """Drop the registry's reference; memory is freed once in-flight requests release theirs"""
+        key = canonical_model_name(model_name)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            logger.info(f"Unloaded model '{key}' (idle {time.time() - entry['last_used']:.0f}s)")
+        return entry is not None
+
+    def unload_idle(self, now=None):
+        """Unload every unpinned model idle for longer than the configured timeout"""
+        if self._idle_unload_seconds <= 0:
+            return []
+        now = now if now is not None else time.time()
+        with self._lock:
+            idle = [key for key, entry in self._entries.items()
+                    if key not in self._pinned_models() and now - entry['last_used'] > self._idle_unload_seconds]
+        for key in idle:
+            self.unload(key)
+        return idle
+
+    def _pinned_models(self):
+        """Canonical pinned names (resolved on first use: canonicalizing imports rembg)"""
+        if self._pinned is None:
+            self._pinned = set(canonical_model_name(m) for m in self._pinned_names)
+        return self._pinned
+
+    def _ensure_reaper(self):
+        if self._idle_unload_seconds <= 0 or self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._start_reaper()
+
+    def _start_reaper(self):
+        interval = max(1.0, min(60.0, self._idle_unload_seconds / 4))
+
+        def reap():
+            while not self._stop.wait(interval):
+                try:
+                    self.unload_idle()
+                except Exception as e:
+                    logger.warning(f"Idle model unload failed: {e}")
+
+        self._reaper = threading.Thread(target=reap, name='model-registry-reaper', daemon=True)
+        self._reaper.start()
+
+    def stats(self):
+        """Per-model memory and usage report for /health"""
+        now = time.time()
+        with self._lock:
+            models = {
+                key: {
+                    'loaded': True,
+                    'rss_mb': round(entry['rss_mb'], 1) if entry['rss_mb'] is not None else None,
+                    'file_mb': round(entry['file_mb'], 1) if entry['file_mb'] is not None else None,
+                    'load_seconds': round(entry['load_seconds'], 2),
+                    'idle_seconds': round(now - entry['last_used'], 1),
+                    'uses': entry['uses'],
+                    'pinned': key in self._pinned_models(),
+                }
+                for key, entry in self._entries.items()
+            }
+            failed = {key: failure['error'] for key, failure in self._failed.items()}
+        rss = read_rss_mb()
+        return {
+            'process_rss_mb': round(rss, 1) if rss is not None else None,
+            'idle_unload_seconds': self._idle_unload_seconds,
+            'models': models,
+            'failed': failed,
+        }
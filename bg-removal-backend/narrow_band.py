@@ -0,0 +1,113 @@
+"""
+Narrow-Band Alpha Refinement for Background Removal
+Post-processing filters only change pixels near the alpha edge; this finds the
+tiles that cover that band and runs a filter on those tiles (plus a margin) only.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Band-limited filtering on/off (1 = on)
+NARROW_BAND_FILTERS = os.environ.get('NARROW_BAND_FILTERS', '1') == '1'
+# Tile edge length in pixels used to cover the edge band
+NARROW_BAND_TILE_SIZE = int(os.environ.get('NARROW_BAND_TILE_SIZE', '64'))
+# Above this fraction of the frame, tiling overhead isn't worth it - run full frame
+NARROW_BAND_MAX_COVERAGE = float(os.environ.get('NARROW_BAND_MAX_COVERAGE', '0.5'))
+
+
+def edge_band(alpha):
+    """
+    Pixels a refinement filter can change: semi-transparent alpha (the trimap's unknown
+    region at its tightest thresholds) plus both sides of any hard 0/255 step.
+    """
+    band = (alpha > 0) & (alpha < 255)
+    step_x = alpha[:, 1:] != alpha[:, :-1]
+    band[:, 1:] |= step_x
+    band[:, :-1] |= step_x
+    step_y = alpha[1:, :] != alpha[:-1, :]
+    band[1:, :] |= step_y
+    band[:-1, :] |= step_y
+    return band
+
+
+def band_regions(alpha, support, tile_size=NARROW_BAND_TILE_SIZE, max_coverage=NARROW_BAND_MAX_COVERAGE):
+    """
+    Cover the edge band with tiles and merge each tile row into horizontal runs.
+
+    A tile is active when a band pixel lies within `support` pixels of it, so every
+    pixel a filter of that support radius could change falls inside an active tile.
+
+    Returns:
+        (regions, coverage): regions is a list of (y0, y1, x0, x1), or None when the
+        band covers more than max_coverage of the frame (caller runs full frame)
+    """
+    height, width = alpha.shape[:2]
+    band = edge_band(alpha)
+    rows = range(0, height, tile_size)
+    cols = range(0, width, tile_size)
+
+    # Tile-row pass then tile-column pass; windows are widened by the filter support
+    row_any = np.stack([band[max(0, y - support):y + tile_size + support].any(axis=0) for y in rows])
+    grid = np.stack([row_any[:, max(0, x - support):x + tile_size + support].any(axis=1) for x in cols], axis=1)
+
+    active_pixels = 0
+    regions = []
+    for i, y0 in enumerate(rows):
+        y1 = min(height, y0 + tile_size)
+        j = 0
+        while j < len(cols):
+            if not grid[i, j]:
+                j += 1
+                continue
+            start = j
+            while j < len(cols) and grid[i, j]:
+                j += 1
+            x0, x1 = cols[start], min(width, cols[j - 1] + tile_size)
+            regions.append((y0, y1, x0, x1))
+            active_pixels += (y1 - y0) * (x1 - x0)
+
+    coverage = active_pixels / float(height * width) if height * width else 0.0
+    if coverage > max_coverage:
+        return None, coverage
+    return regions, coverage
+
+
+def apply_in_regions(fn, target, guides, regions, margin):
+    """
+    Run fn(target_crop, *guide_crops) on each region padded by margin and paste the
+    un-padded part of the result into a copy of target. Untouched pixels keep their value.
+    """
+    height, width = target.shape[:2]
+    result = target.copy()
+    for y0, y1, x0, x1 in regions:
+        py0, py1 = max(0, y0 - margin), min(height, y1 + margin)
+        px0, px1 = max(0, x0 - margin), min(width, x1 + margin)
+        out = np.asarray(fn(target[py0:py1, px0:px1], *[g[py0:py1, px0:px1] for g in guides]))
+        result[y0:y1, x0:x1] = out[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+    return result
+
+
+def run_band_limited(fn, target, guides, alpha, support, name='filter'):
+    """
+    Apply a local filter only where it can change the alpha edge.
+
+    Args:
+        fn: fn(target, *guides) -> array shaped like target; must be local (support-limited)
+            and use no whole-frame statistics - compute those once and close over them
+        target: array the filter rewrites (alpha HxW or RGBA HxWx4)
+        guides: read-only arrays aligned with target (e.g. the RGB image)
+        alpha: uint8 alpha that defines the edge band
+        support: filter radius in pixels; used both to grow the band and as tile margin
+    """
+    if not NARROW_BAND_FILTERS:
+        return np.asarray(fn(target, *guides))
+    regions, coverage = band_regions(alpha, support)
+    if regions is None:
+        logger.debug(f"Narrow band: {name} band covers {coverage:.0%}, running full frame")
+        return np.asarray(fn(target, *guides))
+    logger.debug(f"Narrow band: {name} on {len(regions)} regions ({coverage:.1%} of frame)")
+    return apply_in_regions(fn, target, guides, regions, support)
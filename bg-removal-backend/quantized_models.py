@@ -0,0 +1,96 @@
+"""
+Int8-Quantized Model Variants for Background Removal
+Registers quantized ONNX files as extra model names (e.g. 'birefnet-int8') that load with
+the preprocessing of their fp32 base model, and builds them from the fp32 weights.
+
+Usage:
+    python quantized_models.py                   # quantize the preview model -> PREVIEW_INT8_MODEL_PATH
+    python quantized_models.py --source my.onnx  # quantize a given fp32 ONNX file instead
+"""
+
+import argparse
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Preview model precision: 'fp32' (default) or 'int8' (needs the quantized file, see Usage)
+PREVIEW_MODEL_VARIANT = os.environ.get('PREVIEW_MODEL_VARIANT', 'fp32').strip().lower()
+# Where the int8 preview model is read from (and written to by this script)
+PREVIEW_INT8_MODEL_PATH = os.environ.get(
+    'PREVIEW_INT8_MODEL_PATH',
+    os.path.join(os.environ.get('U2NET_HOME', os.path.expanduser('~/.u2net')), 'birefnet-int8.onnx'))
+
+# variant model name -> (fp32 base model name, ONNX path)
+QUANTIZED_VARIANTS = {
+    'birefnet-int8': ('birefnet', PREVIEW_INT8_MODEL_PATH),
+}
+
+
+def is_quantized_variant(model_name):
+    return model_name in QUANTIZED_VARIANTS
+
+
+def preview_model_names():
+    """Models to try for the preview session, in order (int8 falls back to fp32 if its file is missing)"""
+    if PREVIEW_MODEL_VARIANT == 'int8':
+        return ['birefnet-int8', 'birefnet']
+    return ['birefnet']
+
+
+def _base_session_class(base_model):
+    from rembg.sessions import sessions_class
+    from rembg.sessions.u2net import U2netSession
+    return next((sc for sc in sessions_class if sc.name() == base_model), U2netSession)
+
+
+def load_quantized_session(model_name, sess_opts=None):
+    """
+    rembg session of the base model's class around the quantized ONNX file. The class keeps
+    name() -> base model, so inference.MODEL_SPECS preprocessing applies unchanged.
+    Dynamic int8 quantization targets the CPU execution provider.
+    """
+    import onnxruntime as ort
+
+    base_model, model_path = QUANTIZED_VARIANTS[model_name]
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Quantized model {model_path} not found; build it with 'python quantized_models.py'")
+    session_class = _base_session_class(base_model)
+    # Skip BaseSession.__init__: it would download and load the fp32 weights
+    session = session_class.__new__(session_class)
+    session.model_name = model_name
+    session.inner_session = ort.InferenceSession(model_path, sess_options=sess_opts or ort.SessionOptions(),
+                                                 providers=['CPUExecutionProvider'])
+    return session
+
+
+def quantize_model(source_path, output_path):
+    """Dynamic (weight-only) int8 quantization of an fp32 ONNX file; activations stay fp32"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    quantize_dynamic(source_path, output_path, weight_type=QuantType.QInt8)
+    source_mb = os.path.getsize(source_path) / (1024 * 1024)
+    output_mb = os.path.getsize(output_path) / (1024 * 1024)
+    logger.info(f"Quantized {source_path} ({source_mb:.1f} MB) -> {output_path} ({output_mb:.1f} MB)")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--variant', default='birefnet-int8', choices=sorted(QUANTIZED_VARIANTS))
+    parser.add_argument('--source', default=None, help='fp32 ONNX file (default: the base model rembg downloads)')
+    parser.add_argument('--output', default=None, help='output path (default: the variant path)')
+    args = parser.parse_args()
+
+    base_model, variant_path = QUANTIZED_VARIANTS[args.variant]
+    source = args.source
+    if source is None:
+        from rembg import new_session
+        source = new_session(base_model).inner_session._model_path
+    quantize_model(source, args.output or variant_path)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
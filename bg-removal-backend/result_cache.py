@@ -0,0 +1,195 @@
+"""
+Content-Addressed Result Cache for Background Removal
+Caches encoded results keyed on a hash of the decoded image plus every
+parameter that affects output. Memory LRU tier + optional size-capped disk tier.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Memory tier budget in MB (0 = memory tier off)
+RESULT_CACHE_MEMORY_MB = float(os.environ.get('RESULT_CACHE_MEMORY_MB', '256'))
+# Disk tier directory (unset = disk tier off) and its size cap in MB
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', '')
+RESULT_CACHE_DISK_MB = float(os.environ.get('RESULT_CACHE_DISK_MB', '2048'))
+
+
+def image_digest(image):
+    """Hash of the decoded pixels (mode + size + raw bytes) - same photo, same digest, any container"""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def make_cache_key(image_hash, params):
+    """Combine the image digest with all output-affecting parameters (order-independent)"""
+    encoded = json.dumps(params, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(image_hash.encode() + b'|' + encoded, digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """Two-tier cache of (output_bytes, metadata) entries"""
+
+    def __init__(self, memory_mb=RESULT_CACHE_MEMORY_MB, disk_dir=RESULT_CACHE_DIR, disk_mb=RESULT_CACHE_DISK_MB):
+        self._memory_budget = int(memory_mb * 1024 * 1024)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_dir = disk_dir or None
+        self._disk_budget = int(disk_mb * 1024 * 1024)
+        self._disk_index = {}
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        if self._disk_dir:
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        try:
+            os.makedirs(self._disk_dir, exist_ok=True)
+            for name in os.listdir(self._disk_dir):
+                if name.endswith('.bin'):
+                    path = os.path.join(self._disk_dir, name)
+                    stat = os.stat(path)
+                    size = stat.st_size + self._file_size(path[:-4] + '.json')
+                    self._disk_index[name[:-4]] = (size, stat.st_mtime)
+                    self._disk_bytes += size
+            logger.info(f"Result cache disk tier: {len(self._disk_index)} entries, {self._disk_bytes / (1024 * 1024):.1f} MB in {self._disk_dir}")
+        except OSError as e:
+            logger.warning(f"Result cache disk tier disabled: {e}")
+            self._disk_dir = None
+
+    @staticmethod
+    def _file_size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def get(self, key):
+        """Return (output_bytes, metadata) or None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return entry
+        entry = self._disk_get(key)
+        with self._lock:
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['disk_hits'] += 1
+        self._memory_put(key, entry)
+        return entry
+
+    def put(self, key, output_bytes, metadata):
+        entry = (output_bytes, metadata)
+        self._memory_put(key, entry)
+        self._disk_put(key, entry)
+        with self._lock:
+            self._counters['stores'] += 1
+
+    def _memory_put(self, key, entry):
+        size = len(entry[0])
+        if size > self._memory_budget:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= len(self._memory.pop(key)[0])
+            self._memory[key] = entry
+            self._memory_bytes += size
+            while self._memory_bytes > self._memory_budget:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted[0])
+                self._counters['evictions'] += 1
+
+    def _disk_get(self, key):
+        if not self._disk_dir or key not in self._disk_index:
+            return None
+        path = os.path.join(self._disk_dir, key)
+        try:
+            with open(path + '.bin', 'rb') as f:
+                output_bytes = f.read()
+            with open(path + '.json') as f:
+                metadata = json.load(f)
+            os.utime(path + '.bin')
+            with self._lock:
+                if key in self._disk_index:
+                    self._disk_index[key] = (self._disk_index[key][0], time.time())
+            return output_bytes, metadata
+        except (OSError, ValueError) as e:
+            logger.warning(f"Result cache disk read failed for {key}: {e}")
+            self._disk_remove(key)
+            return None
+
+    def _disk_put(self, key, entry):
+        if not self._disk_dir:
+            return
+        output_bytes, metadata = entry
+        path = os.path.join(self._disk_dir, key)
+        try:
+            encoded_meta = json.dumps(metadata, default=str).encode()
+            size = len(output_bytes) + len(encoded_meta)
+            if size > self._disk_budget:
+                return
+            # Write-then-rename so readers never see a partial entry
+            for suffix, payload in (('.json', encoded_meta), ('.bin', output_bytes)):
+                tmp_path = f"{path}{suffix}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(payload)
+                os.replace(tmp_path, path + suffix)
+        except OSError as e:
+            logger.warning(f"Result cache disk write failed for {key}: {e}")
+            return
+        with self._lock:
+            previous = self._disk_index.get(key)
+            if previous:
+                self._disk_bytes -= previous[0]
+            self._disk_index[key] = (size, time.time())
+            self._disk_bytes += size
+            victims = []
+            while self._disk_bytes > self._disk_budget and self._disk_index:
+                oldest = min(self._disk_index, key=lambda k: self._disk_index[k][1])
+                self._disk_bytes -= self._disk_index.pop(oldest)[0]
+                self._counters['evictions'] += 1
+                victims.append(oldest)
+        for victim in victims:
+            self._disk_unlink(victim)
+
+    def _disk_remove(self, key):
+        with self._lock:
+            entry = self._disk_index.pop(key, None)
+            if entry:
+                self._disk_bytes -= entry[0]
+        self._disk_unlink(key)
+
+    def _disk_unlink(self, key):
+        for suffix in ('.bin', '.json'):
+            try:
+                os.remove(os.path.join(self._disk_dir, key + suffix))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters['memory_hits'] + self._counters['disk_hits'] + self._counters['misses']
+            hits = self._counters['memory_hits'] + self._counters['disk_hits']
+            return {
+                **self._counters,
+                'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_mb': round(self._memory_bytes / (1024 * 1024), 1),
+                'memory_budget_mb': round(self._memory_budget / (1024 * 1024), 1),
+                'disk_enabled': bool(self._disk_dir),
+                'disk_entries': len(self._disk_index),
+                'disk_mb': round(self._disk_bytes / (1024 * 1024), 1),
+                'disk_budget_mb': round(self._disk_budget / (1024 * 1024), 1),
+            }
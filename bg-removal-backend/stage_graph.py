@@ -0,0 +1,90 @@
+"""
+Concurrent Stage Graph for Premium Pipelines
+Runs a request's pipeline stages as a small dependency graph: stages whose inputs are
+ready run at the same time (e.g. semantic inference next to matting and colour-only
+pre-work), and the pipeline joins on their results where it needs them.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from inference_pool import available_cores
+from stage_metrics import current_trace, use_trace
+
+logger = logging.getLogger(__name__)
+
+# Threads shared by all requests' graph stages ('auto' = min(4, cores); 0 or 1 = run stages in order)
+_workers_env = os.environ.get('STAGE_GRAPH_WORKERS', 'auto').strip().lower()
+STAGE_GRAPH_WORKERS = min(4, available_cores()) if _workers_env == 'auto' else int(_workers_env)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _shared_executor(workers):
+    """Process-wide stage thread pool, sized by its first user"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stage-graph')
+        return _executor
+
+
+class StageGraph:
+    """
+    add(name, fn, deps) registers a stage; fn is called with the results of deps (in order).
+    run() returns {name: result}. Stages only exchange results, never shared mutable
+    buffers, so no stage needs a copy of another's input. With STAGE_GRAPH_WORKERS <= 1
+    the stages run in the calling thread, in the order they were added.
+    """
+
+    def __init__(self, workers=None):
+        self._workers = STAGE_GRAPH_WORKERS if workers is None else workers
+        self._stages = {}  # name -> (fn, deps), insertion order = sequential order
+
+    def add(self, name, fn, deps=()):
+        missing = [dep for dep in deps if dep not in self._stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stages {missing}")
+        self._stages[name] = (fn, tuple(deps))
+        return self
+
+    def run(self):
+        if self._workers <= 1 or len(self._stages) <= 1:
+            results = {}
+            for name, (fn, deps) in self._stages.items():
+                results[name] = fn(*(results[dep] for dep in deps))
+            return results
+        return self._run_concurrent()
+
+    def _run_concurrent(self):
+        executor = _shared_executor(self._workers)
+        trace = current_trace()  # Stage timings of worker threads land in the request's trace
+        results, running, error = {}, {}, None
+        pending = dict(self._stages)
+
+        def call(fn, args):
+            with use_trace(trace):
+                return fn(*args)
+
+        while pending or running:
+            if error is None:
+                for name in [n for n, (_, deps) in pending.items() if all(dep in results for dep in deps)]:
+                    fn, deps = pending.pop(name)
+                    running[executor.submit(call, fn, [results[dep] for dep in deps])] = name
+            if not running:
+                break  # Only stages downstream of a failure are left
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    # Let stages already running finish (they hold request buffers), then raise
+                    logger.warning(f"Stage '{name}' failed: {e}")
+                    error = error or e
+        if error is not None:
+            raise error
+        return results
@@ -0,0 +1,258 @@
+"""
+Per-Stage Tracing for Background Removal
+Records wall time and peak RSS for every named pipeline stage of a request and
+aggregates them into per-megapixel-bucket histograms (served on /metrics).
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Stage tracing on/off (1 = on)
+STAGE_TRACING = os.environ.get('STAGE_TRACING', '1') == '1'
+# Histogram bucket upper bounds (seconds) and request-size buckets (megapixels)
+LATENCY_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MEGAPIXEL_BUCKETS = (1, 4, 8, 16, 25)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_local = threading.local()
+
+
+def _peak_rss_mb():
+    """Process high-water RSS (ru_maxrss is KB on Linux)"""
+    if resource is None:
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _rss_mb():
+    """Current RSS; falls back to the high-water mark where /proc isn't available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1024.0 * 1024.0)
+    except (OSError, ValueError, IndexError):
+        return _peak_rss_mb()
+
+
+def megapixel_bucket(megapixels):
+    """Histogram label for a request size, e.g. '4-8'"""
+    lower = 0
+    for upper in MEGAPIXEL_BUCKETS:
+        if megapixels <= upper:
+            return f"{lower}-{upper}"
+        lower = upper
+    return f">{MEGAPIXEL_BUCKETS[-1]}"
+
+
+class StageTrace:
+    """
+    Stage timings for one request. Stages are either context managers (stage()) or
+    marks (mark() closes a stage that began when the previous stage ended).
+
+    Peak RSS is process-wide: the max of RSS at both ends of the stage, or the new
+    process high-water mark if the stage raised it. Concurrent requests share it.
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.stages = []
+        self.active = None  # name of the context-manager stage running right now (job status)
+        self._running = []  # context-manager stages in progress (concurrent graph stages overlap)
+        self.started = time.perf_counter()
+        self._mark = (self.started, _rss_mb(), _peak_rss_mb())
+
+    def _record(self, name, start):
+        start_time, start_rss, start_hwm = start
+        end_time, end_rss, end_hwm = time.perf_counter(), _rss_mb(), _peak_rss_mb()
+        peak = max(start_rss, end_rss)
+        if end_hwm > start_hwm:
+            peak = max(peak, end_hwm)
+        self.stages.append({
+            'stage': name,
+            'ms': round((end_time - start_time) * 1000.0, 2),
+            'peak_rss_mb': round(peak, 1),
+            'rss_delta_mb': round(end_rss - start_rss, 1),
+        })
+        self._mark = (end_time, end_rss, end_hwm)
+
+    @contextmanager
+    def stage(self, name):
+        start = (time.perf_counter(), _rss_mb(), _peak_rss_mb())
+        self._running.append(name)
+        self.active = name
+        try:
+            yield
+        finally:
+            self._running.remove(name)
+            self.active = self._running[-1] if self._running else None
+            self._record(name, start)
+
+    def mark(self, name):
+        self._record(name, self._mark)
+
+    def summary(self, megapixels):
+        return {
+            'pipeline': self.pipeline,
+            'megapixels': round(float(megapixels), 2),
+            'megapixel_bucket': megapixel_bucket(megapixels),
+            'total_ms': round((time.perf_counter() - self.started) * 1000.0, 2),
+            'peak_rss_mb': max([s['peak_rss_mb'] for s in self.stages] or [0.0]),
+            'stages': self.stages,
+        }
+
+
+class StageMetrics:
+    """Latency histograms and peak RSS per (pipeline, megapixel bucket, stage)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_SECONDS):
+        self._buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, summary):
+        """Add one request summary; repeated stage names within a request are summed"""
+        per_stage = {}
+        for entry in summary['stages']:
+            ms, peak = per_stage.get(entry['stage'], (0.0, 0.0))
+            per_stage[entry['stage']] = (ms + entry['ms'], max(peak, entry['peak_rss_mb']))
+        per_stage['total'] = (summary['total_ms'], summary['peak_rss_mb'])
+
+        with self._lock:
+            for stage, (ms, peak) in per_stage.items():
+                key = (summary['pipeline'], summary['megapixel_bucket'], stage)
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = {
+                        'counts': [0] * (len(self._buckets) + 1), 'count': 0,
+                        'sum_ms': 0.0, 'max_ms': 0.0, 'peak_rss_mb': 0.0,
+                    }
+                seconds = ms / 1000.0
+                index = next((i for i, upper in enumerate(self._buckets) if seconds <= upper), len(self._buckets))
+                series['counts'][index] += 1
+                series['count'] += 1
+                series['sum_ms'] += ms
+                series['max_ms'] = max(series['max_ms'], ms)
+                series['peak_rss_mb'] = max(series['peak_rss_mb'], peak)
+
+    def _quantile_ms(self, series, q):
+        """Upper bound of the bucket holding the q-th observation"""
+        target = q * series['count']
+        seen = 0
+        for upper, count in zip(self._buckets, series['counts']):
+            seen += count
+            if seen >= target:
+                return min(upper * 1000.0, series['max_ms'])
+        return series['max_ms']
+
+    def snapshot(self):
+        """{pipeline: {megapixel_bucket: {'dominant_stage', 'stages': {stage: summary}}}}"""
+        with self._lock:
+            items = [(key, dict(series, counts=list(series['counts']))) for key, series in self._series.items()]
+        result = {}
+        for (pipeline, mp_bucket, stage), series in sorted(items):
+            group = result.setdefault(pipeline, {}).setdefault(mp_bucket, {'dominant_stage': None, 'stages': {}})
+            group['stages'][stage] = {
+                'count': series['count'],
+                'mean_ms': round(series['sum_ms'] / series['count'], 2),
+                'p50_ms': round(self._quantile_ms(series, 0.5), 2),
+                'p95_ms': round(self._quantile_ms(series, 0.95), 2),
+                'max_ms': round(series['max_ms'], 2),
+                'peak_rss_mb': series['peak_rss_mb'],
+            }
+        for pipeline in result.values():
+            for group in pipeline.values():
+                candidates = [(s['mean_ms'], name) for name, s in group['stages'].items() if name != 'total']
+                if candidates:
+                    group['dominant_stage'] = max(candidates)[1]
+        return result
+
+    def prometheus(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            items = sorted((key, dict(series, counts=list(series['counts']))) for key, series in self._series.items())
+        lines = [
+            '# HELP bg_stage_duration_seconds Wall time per pipeline stage',
+            '# TYPE bg_stage_duration_seconds histogram',
+        ]
+        for (pipeline, mp_bucket, stage), series in items:
+            labels = f'pipeline="{pipeline}",megapixels="{mp_bucket}",stage="{stage}"'
+            cumulative = 0
+            for upper, count in zip(self._buckets, series['counts']):
+                cumulative += count
+                lines.append(f'bg_stage_duration_seconds_bucket{{{labels},le="{upper:g}"}} {cumulative}')
+            lines.append(f'bg_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {series["count"]}')
+            lines.append(f'bg_stage_duration_seconds_sum{{{labels}}} {series["sum_ms"] / 1000.0:.6f}')
+            lines.append(f'bg_stage_duration_seconds_count{{{labels}}} {series["count"]}')
+        lines.append('# HELP bg_stage_peak_rss_megabytes Highest process RSS seen during the stage')
+        lines.append('# TYPE bg_stage_peak_rss_megabytes gauge')
+        for (pipeline, mp_bucket, stage), series in items:
+            labels = f'pipeline="{pipeline}",megapixels="{mp_bucket}",stage="{stage}"'
+            lines.append(f'bg_stage_peak_rss_megabytes{{{labels}}} {series["peak_rss_mb"]:.1f}')
+        return '\n'.join(lines) + '\n'
+
+
+stage_metrics = StageMetrics()
+
+
+def begin_trace(pipeline, force=False):
+    """Start tracing the current request (thread-local); returns the trace or None when off"""
+    _local.trace = StageTrace(pipeline) if STAGE_TRACING or force else None
+    return _local.trace
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def use_trace(trace):
+    """Make `trace` current in this thread for a block (pipeline stages run on worker threads)"""
+    previous = current_trace()
+    _local.trace = trace
+    try:
+        yield
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def trace_stage(name):
+    """Time a block as stage `name` of the current request (no-op outside a trace)"""
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
+
+
+def mark_stage(name):
+    """Close stage `name`: it started when the previous stage ended (no-op outside a trace)"""
+    trace = current_trace()
+    if trace is not None:
+        trace.mark(name)
+
+
+def end_trace(megapixels):
+    """Finish the current trace, add it to the histograms and return its summary ({} when off)"""
+    trace = current_trace()
+    _local.trace = None
+    if trace is None:
+        return {}
+    summary = trace.summary(megapixels)
+    stage_metrics.observe(summary)
+    return summary
+
+
+def discard_trace():
+    """Drop an unfinished trace (errors, cache hits) so it can't leak into the next request"""
+    _local.trace = None
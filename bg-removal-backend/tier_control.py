@@ -0,0 +1,129 @@
+"""
+Load-Adaptive Model Tier Selection for Background Removal
+Watches queue depth and recent request latency per pipeline and, when the latency SLO
+is at risk, steps new requests down to lighter processing tiers until the load passes.
+"""
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Tier control on/off (1 = on). Off: every request runs at full quality
+TIER_CONTROL = os.environ.get('TIER_CONTROL', '0') == '1'
+# Latency SLO per pipeline (seconds of total request time)
+TIER_SLO_SECONDS = {
+    'free_preview': float(os.environ.get('TIER_SLO_PREVIEW_SECONDS', '3')),
+    'premium': float(os.environ.get('TIER_SLO_PREMIUM_SECONDS', '30')),
+}
+# Step down once recent latency passes this share of the SLO (and again at the SLO itself)
+TIER_SLO_HEADROOM = float(os.environ.get('TIER_SLO_HEADROOM', '0.8'))
+# Step back up only once recent latency is below this share of the SLO (hysteresis)
+TIER_RECOVER_FRACTION = float(os.environ.get('TIER_RECOVER_FRACTION', '0.5'))
+# Queued requests that count as one step of pressure on their own
+TIER_QUEUE_DEPTH_STEP = int(os.environ.get('TIER_QUEUE_DEPTH_STEP', '4'))
+# Minimum seconds between tier changes of one pipeline
+TIER_COOLDOWN_SECONDS = float(os.environ.get('TIER_COOLDOWN_SECONDS', '10'))
+# Weight of the newest request in the latency moving average
+TIER_LATENCY_SMOOTHING = 0.3
+
+# Degradation steps per pipeline, lightest impact first; level N applies the first N steps
+TIER_STEPS = {
+    # Product/document edges are hard: dropping fine matting there costs least
+    'premium': ('skip_matting_non_hair', 'light_semantic_model'),
+    'free_preview': ('light_preview_model',),
+}
+
+
+class TierController:
+    """
+    Per-pipeline degradation level from two signals: a moving average of recent request
+    latency against the pipeline's SLO, and the current queue depth (depth_fns[pipeline]()).
+    Levels rise immediately when pressure rises and fall one step at a time after a cooldown,
+    once latency has recovered, so the tier doesn't flap between light and full requests.
+    """
+
+    def __init__(self, depth_fns, enabled=TIER_CONTROL, slo_seconds=None):
+        self.enabled = enabled
+        self._depth_fns = depth_fns
+        self._slo = dict(TIER_SLO_SECONDS, **(slo_seconds or {}))
+        self._lock = threading.Lock()
+        self._state = {pipeline: {'level': 0, 'latency': None, 'changed_at': 0.0, 'degraded': 0, 'requests': 0}
+                       for pipeline in TIER_STEPS}
+
+    def observe(self, pipeline, seconds):
+        """Feed one finished request's total latency"""
+        with self._lock:
+            state = self._state[pipeline]
+            previous = state['latency']
+            state['latency'] = seconds if previous is None else \
+                previous + TIER_LATENCY_SMOOTHING * (seconds - previous)
+
+    def _queue_depth(self, pipeline):
+        try:
+            return int(self._depth_fns[pipeline]())
+        except Exception:
+            return 0
+
+    def _target_level(self, pipeline, latency, depth):
+        slo = self._slo[pipeline]
+        pressure = 0
+        if latency is not None:
+            pressure = 2 if latency >= slo else 1 if latency >= slo * TIER_SLO_HEADROOM else 0
+        pressure = max(pressure, depth // max(1, TIER_QUEUE_DEPTH_STEP))
+        return min(pressure, len(TIER_STEPS[pipeline]))
+
+    def decide(self, pipeline):
+        """
+        Tier for a new request -> (steps, report). steps is the tuple of degradation steps to
+        apply (empty = full quality); report goes into the request's debug_stats.
+        """
+        if not self.enabled:
+            return (), {'level': 0, 'controlled': False}
+        depth = self._queue_depth(pipeline)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state[pipeline]
+            target = self._target_level(pipeline, state['latency'], depth)
+            level = state['level']
+            if target > level:
+                level = target
+            elif level > 0 and now - state['changed_at'] >= TIER_COOLDOWN_SECONDS:
+                recovered = state['latency'] is None or state['latency'] < self._slo[pipeline] * TIER_RECOVER_FRACTION
+                if recovered and depth < TIER_QUEUE_DEPTH_STEP:
+                    level -= 1
+            if level != state['level']:
+                logger.warning(f"⚖️ Tier control: {pipeline} level {state['level']} -> {level} "
+                               f"(recent latency {state['latency'] or 0:.2f}s, SLO {self._slo[pipeline]:g}s, queue {depth})")
+                state['level'], state['changed_at'] = level, now
+            state['requests'] += 1
+            if level:
+                state['degraded'] += 1
+            steps = TIER_STEPS[pipeline][:level]
+            return steps, {
+                'level': level,
+                'controlled': True,
+                'steps': list(steps),
+                'recent_latency_seconds': round(state['latency'], 2) if state['latency'] is not None else None,
+                'slo_seconds': self._slo[pipeline],
+                'queue_depth': depth,
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'pipelines': {
+                    pipeline: {
+                        'level': state['level'],
+                        'steps': list(TIER_STEPS[pipeline][:state['level']]),
+                        'slo_seconds': self._slo[pipeline],
+                        'recent_latency_seconds': round(state['latency'], 2) if state['latency'] is not None else None,
+                        'requests': state['requests'],
+                        'degraded': state['degraded'],
+                    }
+                    for pipeline, state in self._state.items()
+                },
+            }
@@ -0,0 +1,140 @@
+"""
+Coarse-to-Fine Tiled Matting for Background Removal
+The semantic mask (model resolution, upsampled) covers the interior; the matting
+model only runs on overlapping full-resolution tiles along the subject boundary,
+with seams cross-faded, so memory per step stays bounded as megapixels grow.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from inference import predict_masks
+from narrow_band import edge_band
+
+logger = logging.getLogger(__name__)
+
+# Coarse-to-fine matting on/off (1 = on) and the image size it starts at
+COARSE_TO_FINE_MATTING = os.environ.get('COARSE_TO_FINE_MATTING', '1') == '1'
+COARSE_TO_FINE_MIN_MEGAPIXELS = float(os.environ.get('COARSE_TO_FINE_MIN_MEGAPIXELS', '8'))
+# Full-resolution tile edge length and overlap between neighbouring tiles (pixels)
+MATTING_TILE_SIZE = int(os.environ.get('MATTING_TILE_SIZE', '1024'))
+MATTING_TILE_OVERLAP = int(os.environ.get('MATTING_TILE_OVERLAP', '128'))
+# Tiles per ONNX run (bounded so peak memory doesn't depend on the boundary length)
+MATTING_TILE_BATCH = int(os.environ.get('MATTING_TILE_BATCH', '2'))
+# A tile whose matte differs from the semantic mask by more than this mean fraction is
+# discarded (the model min-max normalises per input, which fails on near-uniform tiles)
+MATTING_TILE_MAX_DISAGREEMENT = 0.25
+# Band detection runs on a strided view no larger than this on its longest side
+BAND_PROBE_SIZE = 1024
+
+
+def use_coarse_to_fine(megapixels):
+    """True if an image of this size should be matted tile-by-tile"""
+    return COARSE_TO_FINE_MATTING and megapixels >= COARSE_TO_FINE_MIN_MEGAPIXELS
+
+
+def _tile_starts(length, tile_size, stride):
+    """Tile origins covering [0, length); the last tile is aligned to the far edge"""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size + 1, stride))
+    if starts[-1] + tile_size < length:
+        starts.append(length - tile_size)
+    return starts
+
+
+def plan_boundary_tiles(alpha, tile_size=MATTING_TILE_SIZE, overlap=MATTING_TILE_OVERLAP):
+    """
+    Grid of overlapping tiles; keep those the alpha edge band passes through.
+
+    Returns:
+        (tiles, grid_shape): tiles is a list of (i, j, y0, y1, x0, x1) in raster order
+    """
+    height, width = alpha.shape[:2]
+    stride = max(1, tile_size - overlap)
+    # Strided view: no full-resolution temporaries just to find the boundary
+    step = max(1, int(np.ceil(max(height, width) / float(BAND_PROBE_SIZE))))
+    band = edge_band(alpha[::step, ::step])
+
+    ys = _tile_starts(height, tile_size, stride)
+    xs = _tile_starts(width, tile_size, stride)
+    tiles = []
+    for i, y0 in enumerate(ys):
+        y1 = min(height, y0 + tile_size)
+        for j, x0 in enumerate(xs):
+            x1 = min(width, x0 + tile_size)
+            if band[y0 // step:-(-y1 // step), x0 // step:-(-x1 // step)].any():
+                tiles.append((i, j, y0, y1, x0, x1))
+    return tiles, (len(ys), len(xs))
+
+
+def _ramp(length, overlap, start, end):
+    """1-D blend weight: linear 0->1 over `overlap` at the start and/or 1->0 at the end"""
+    weights = np.ones(length, dtype=np.float32)
+    n = min(overlap, length // 2)
+    if n > 0:
+        ramp = (np.arange(n, dtype=np.float32) + 0.5) / n
+        if start:
+            weights[:n] = ramp
+        if end:
+            weights[-n:] = np.minimum(weights[-n:], ramp[::-1])
+    return weights
+
+
+def tile_weights(tile, active, alpha_shape, overlap):
+    """
+    Blend weights for one tile, applied in raster order over the current alpha.
+    Leading edges (top/left) always cross-fade: with the previous tile, or with the
+    semantic mask. Trailing edges only fade out when no tile follows on that side.
+    """
+    i, j, y0, y1, x0, x1 = tile
+    height, width = alpha_shape[:2]
+    wy = _ramp(y1 - y0, overlap, start=y0 > 0, end=y1 < height and (i + 1, j) not in active)
+    wx = _ramp(x1 - x0, overlap, start=x0 > 0, end=x1 < width and (i, j + 1) not in active)
+    return np.outer(wy, wx)
+
+
+def refine_boundary_tiles(session, rgb, alpha, tile_size=MATTING_TILE_SIZE, overlap=MATTING_TILE_OVERLAP,
+                          batch_size=MATTING_TILE_BATCH):
+    """
+    Run the matting session on boundary tiles at full resolution and blend into alpha in place.
+
+    Args:
+        session: rembg session used for matting
+        rgb: HxWx3 uint8 full-resolution image
+        alpha: HxW uint8 semantic mask at full resolution (modified in place)
+
+    Returns:
+        dict of tile statistics for debug_stats
+    """
+    tiles, grid_shape = plan_boundary_tiles(alpha, tile_size, overlap)
+    active = set((t[0], t[1]) for t in tiles)
+    rejected = 0
+    for start in range(0, len(tiles), max(1, batch_size)):
+        chunk = tiles[start:start + max(1, batch_size)]
+        crops = [rgb[y0:y1, x0:x1] for _, _, y0, y1, x0, x1 in chunk]
+        fine_masks = predict_masks(session, crops)
+        for tile, fine in zip(chunk, fine_masks):
+            _, _, y0, y1, x0, x1 = tile
+            current = alpha[y0:y1, x0:x1]
+            disagreement = np.abs(fine.astype(np.int16) - current).mean() / 255.0
+            if disagreement > MATTING_TILE_MAX_DISAGREEMENT:
+                rejected += 1
+                continue
+            weights = tile_weights(tile, active, alpha.shape, overlap)
+            blended = current * (1.0 - weights) + fine * weights
+            current[...] = (blended + 0.5).astype(np.uint8)
+
+    total_tiles = grid_shape[0] * grid_shape[1]
+    logger.info(f"Coarse-to-fine matting: {len(tiles)}/{total_tiles} boundary tiles "
+                f"({tile_size}px, overlap {overlap}px), {rejected} rejected")
+    return {
+        'matting_mode': 'coarse_to_fine',
+        'matting_tiles': len(tiles),
+        'matting_tiles_total': total_tiles,
+        'matting_tiles_rejected': rejected,
+        'matting_tile_size': tile_size,
+        'matting_tile_overlap': overlap,
+    }
@@ -0,0 +1,119 @@
+"""
+Staged Startup for Background Removal
+Loads models in priority order on a background thread (preview model first), so the
+server binds and answers /health at once while the heavier models are still loading.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from inference import predict_mask
+
+logger = logging.getLogger(__name__)
+
+# 'staged' = load every model in the background after the server binds;
+# 'eager' = load the preview model before the app finishes importing, the rest in the background
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'staged').strip().lower()
+# Run one tiny inference per warmed model, so ONNX Runtime's first-run setup isn't paid by a request (1 = on)
+STARTUP_WARMUP_PROBE = os.environ.get('STARTUP_WARMUP_PROBE', '1') == '1'
+# Retry a failed stage after this many seconds, doubling up to STARTUP_RETRY_MAX_SECONDS (0 = no retries)
+STARTUP_RETRY_SECONDS = float(os.environ.get('STARTUP_RETRY_SECONDS', '10'))
+STARTUP_RETRY_MAX_SECONDS = float(os.environ.get('STARTUP_RETRY_MAX_SECONDS', '300'))
+# Side of the blank probe image (the model resizes it to its own input size anyway)
+STARTUP_PROBE_SIZE = 64
+
+
+class StartupWarmup:
+    """
+    Runs named stages [(name, loader)] in order; loader() returns the stage's session.
+    Stage states go pending -> loading -> warm (or failed: that model then loads on its
+    first request as before, and the stage is retried with backoff until it is warm, so
+    readiness recovers from a transient failure). Requests arriving mid-load wait for the same load.
+    """
+
+    def __init__(self, stages, mode=STARTUP_MODE, probe=STARTUP_WARMUP_PROBE, ready_stages=('preview',),
+                 retry_seconds=STARTUP_RETRY_SECONDS, retry_max_seconds=STARTUP_RETRY_MAX_SECONDS):
+        self.mode = mode
+        self._stages = stages
+        self._probe = probe
+        self._retry_seconds = retry_seconds
+        self._retry_max_seconds = retry_max_seconds
+        self._ready_stages = ready_stages
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._status = {name: {'state': 'pending'} for name, _ in stages}
+        self._thread = None
+
+    def start(self):
+        """'eager' runs the first stage before returning; everything else (and retries) runs on a daemon thread"""
+        stages = list(self._stages)
+        if self.mode == 'eager' and stages:
+            self._run_stage(*stages.pop(0))
+        if self._stages:
+            self._thread = threading.Thread(target=self._run, args=(stages,), name='startup-warmup', daemon=True)
+            self._thread.start()
+
+    def _run(self, stages):
+        for name, loader in stages:
+            self._run_stage(name, loader)
+        logger.info(f"✅ Startup warm-up finished in {time.perf_counter() - self._started:.2f}s")
+        self._retry_failed()
+
+    def _retry_failed(self):
+        """Re-run failed stages with exponential backoff until every stage is warm"""
+        delay = self._retry_seconds
+        while delay > 0:
+            failed = [(name, loader) for name, loader in self._stages if self._state(name) == 'failed']
+            if not failed:
+                return
+            time.sleep(delay)
+            for name, loader in failed:
+                self._run_stage(name, loader)
+            delay = min(delay * 2, self._retry_max_seconds)
+
+    def _run_stage(self, name, loader):
+        attempts = self._status[name].get('attempts', 0) + 1
+        self._update(name, state='loading', attempts=attempts)
+        start = time.perf_counter()
+        try:
+            session = loader()
+            load_seconds = time.perf_counter() - start
+            if self._probe:
+                blank = np.full((STARTUP_PROBE_SIZE, STARTUP_PROBE_SIZE, 3), 128, dtype=np.uint8)
+                predict_mask(session, blank)
+            self._update(name, state='warm', error=None, model=getattr(session, 'model_name', None),
+                         load_seconds=round(load_seconds, 2),
+                         probe_seconds=round(time.perf_counter() - start - load_seconds, 2),
+                         ready_after_seconds=round(time.perf_counter() - self._started, 2))
+            logger.info(f"🔥 Startup stage '{name}' warm after {time.perf_counter() - self._started:.2f}s")
+        except Exception as e:
+            self._update(name, state='failed', error=str(e))
+            retry = ", retrying in the background" if self._retry_seconds > 0 else ""
+            logger.warning(f"Startup stage '{name}' failed (attempt {attempts}; loads on first request{retry}): {e}")
+
+    def _state(self, name):
+        with self._lock:
+            return self._status[name]['state']
+
+    def _update(self, name, **fields):
+        with self._lock:
+            self._status[name] = dict(self._status[name], **fields)
+
+    def is_ready(self):
+        """True once every ready stage (the preview model) is warm"""
+        return self.status()['ready']
+
+    def status(self):
+        with self._lock:
+            stages = {name: dict(entry) for name, entry in self._status.items()}
+        return {
+            'mode': self.mode,
+            'ready': all(stages[name]['state'] == 'warm' for name in self._ready_stages),
+            'allWarm': all(entry['state'] == 'warm' for entry in stages.values()),
+            'uptimeSeconds': round(time.perf_counter() - self._started, 2),
+            'stages': stages,
+        }
@@ -4,11 +4,12 @@ import os
 import cv2
 import numpy as np
 from rembg import remove
-from PIL import Image, ImageEnhance, ImageFilter, ImageDraw
+from PIL import Image, ImageDraw
 import io
 import base64
 from datetime import datetime
 import tempfile
+from tool_engine import TOOLS, ImageBuffer, apply_tool_to_buffer, chain_steps, fold_steps, run_steps
 
 app = Flask(__name__)
 CORS(app)
@@ -22,6 +23,9 @@ os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 # Maximum file size: 15MB
 app.config['MAX_CONTENT_LENGTH'] = 15 * 1024 * 1024
 
+# Most tools accepted by one /process-chain request
+MAX_CHAIN_TOOLS = int(os.environ.get('MAX_CHAIN_TOOLS', '20'))
+
 @app.route('/test', methods=['GET'])
 def test():
     """Health check endpoint"""
@@ -67,6 +71,9 @@ def process_image():
         tool = data.get('tool')
         params = data.get('params', {})
         
+        if tool not in TOOLS:
+            return jsonify({'error': f'Unknown tool: {tool}'}), 400
+        
         filepath = os.path.join(UPLOAD_FOLDER, filename)
         if not os.path.exists(filepath):
             return jsonify({'error': 'File not found'}), 404
@@ -96,6 +103,51 @@ def process_image():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/process-chain', methods=['POST'])
+def process_chain():
+    """Apply an ordered list of tools in one pass: one decode, one save, one preview"""
+    try:
+        data = request.json
+        filename = data.get('filename')
+        chain = data.get('tools') or []
+        
+        if not isinstance(chain, list) or not chain:
+            return jsonify({'error': 'tools must be a non-empty list of {"tool", "params"}'}), 400
+        if len(chain) > MAX_CHAIN_TOOLS:
+            return jsonify({'error': f'At most {MAX_CHAIN_TOOLS} tools per chain'}), 400
+        for entry in chain:
+            if not isinstance(entry, dict) or entry.get('tool') not in TOOLS:
+                return jsonify({'error': f'Unknown tool: {entry.get("tool") if isinstance(entry, dict) else entry}'}), 400
+        
+        filepath = os.path.join(UPLOAD_FOLDER, filename)
+        if not os.path.exists(filepath):
+            return jsonify({'error': 'File not found'}), 404
+        
+        # Decode once; brightness/contrast/invert tables and color matrices are folded together
+        buffer = ImageBuffer.from_image(Image.open(filepath))
+        steps = fold_steps(chain_steps(chain))
+        processed_img = run_steps(buffer, steps, fold=False).to_image()
+        
+        # Only the final result is saved
+        output_filename = f"processed_{filename}"
+        output_path = os.path.join(PROCESSED_FOLDER, output_filename)
+        processed_img.save(output_path)
+        
+        buffered = io.BytesIO()
+        processed_img.save(buffered, format="PNG")
+        img_str = base64.b64encode(buffered.getvalue()).decode()
+        
+        return jsonify({
+            'success': True,
+            'filename': output_filename,
+            'preview': f"data:image/png;base64,{img_str}",
+            'tools_applied': [entry['tool'] for entry in chain],
+            'passes': len(steps)
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/remove-background', methods=['POST'])
 def remove_background():
     """Remove background using rembg"""
@@ -216,68 +268,9 @@ def download_file(filename):
         return jsonify({'error': str(e)}), 500
 
 def apply_tool(img, tool, params):
-    """Apply various image processing tools"""
-    
-    if tool == 'auto-fix':
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.2)
-        enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(1.1)
-        enhancer = ImageEnhance.Sharpness(img)
-        img = enhancer.enhance(1.3)
-    
-    elif tool == 'deblur':
-        img = img.filter(ImageFilter.SHARPEN)
-        img = img.filter(ImageFilter.UnsharpMask(radius=2, percent=150))
-    
-    elif tool == 'denoise':
-        img = img.filter(ImageFilter.MedianFilter(size=3))
-    
-    elif tool == 'enhance':
-        enhancer = ImageEnhance.Color(img)
-        img = enhancer.enhance(1.2)
-        enhancer = ImageEnhance.Sharpness(img)
-        img = enhancer.enhance(1.5)
-    
-    elif tool == 'brightness':
-        value = params.get('value', 0) / 100
-        enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(1 + value)
-    
-    elif tool == 'contrast':
-        value = params.get('value', 0) / 100
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1 + value)
-    
-    elif tool == 'saturation':
-        value = params.get('value', 0) / 100
-        enhancer = ImageEnhance.Color(img)
-        img = enhancer.enhance(1 + value)
-    
-    elif tool == 'grayscale':
-        img = img.convert('L').convert('RGB')
-    
-    elif tool == 'sepia':
-        img = img.convert('RGB')
-        pixels = img.load()
-        for i in range(img.width):
-            for j in range(img.height):
-                r, g, b = pixels[i, j]
-                tr = int(0.393 * r + 0.769 * g + 0.189 * b)
-                tg = int(0.349 * r + 0.686 * g + 0.168 * b)
-                tb = int(0.272 * r + 0.534 * g + 0.131 * b)
-                pixels[i, j] = (min(tr, 255), min(tg, 255), min(tb, 255))
-    
-    elif tool == 'invert':
-        img = Image.eval(img, lambda x: 255 - x)
-    
-    elif tool == 'blur-bg':
-        img = img.filter(ImageFilter.GaussianBlur(radius=10))
-    
-    elif tool == 'sharpen':
-        img = img.filter(ImageFilter.SHARPEN)
-    
-    return img
+    """Apply one image processing tool (tool_engine.TOOLS) to a PIL image"""
+    buffer = apply_tool_to_buffer(ImageBuffer.from_image(img), tool, params)
+    return buffer.to_image()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
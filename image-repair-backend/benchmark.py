@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Image Repair Service
+Run locally against synthetic images.
+
+Usage:
+    python benchmark.py tools                     # per-tool time: tool engine vs the PIL implementation, per image size
+    python benchmark.py tools --tools sepia invert --megapixels 1 12
+    python benchmark.py chain                     # tool chains: one /process cycle per tool vs one /process-chain pass
+    python benchmark.py chain --chains saturate-sepia
+"""
+
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter
+
+from tool_engine import TOOLS, ImageBuffer, apply_chain_to_buffer, apply_tool_to_buffer, chain_steps, fold_steps
+
+DEFAULT_MEGAPIXELS = [1, 4, 12]
+
+
+def synthetic_image(megapixels, seed=0):
+    """Photo-like RGB test image: smooth gradients plus sensor-style noise"""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1_000_000 / width)
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        128 + 100 * np.sin(x / 97.0),
+        128 + 100 * np.cos(y / 131.0),
+        128 + 100 * np.sin((x + y) / 173.0),
+    ], axis=2)
+    noise = rng.normal(0, 6, size=base.shape)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), mode='RGB')
+
+
+def _timed(fn, repeats):
+    """Best-of-N wall time in seconds and the last result"""
+    best, result = float('inf'), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _legacy_sepia(img):
+    img = img.convert('RGB')
+    pixels = img.load()
+    for i in range(img.width):
+        for j in range(img.height):
+            r, g, b = pixels[i, j]
+            tr = int(0.393 * r + 0.769 * g + 0.189 * b)
+            tg = int(0.349 * r + 0.686 * g + 0.168 * b)
+            tb = int(0.272 * r + 0.534 * g + 0.131 * b)
+            pixels[i, j] = (min(tr, 255), min(tg, 255), min(tb, 255))
+    return img
+
+
+def _enhance(img, *steps):
+    for enhancer, factor in steps:
+        img = enhancer(img).enhance(factor)
+    return img
+
+
+# The PIL implementations the tool engine replaced (slider tools at +30%)
+LEGACY_TOOLS = {
+    'auto-fix': lambda img: _enhance(img, (ImageEnhance.Contrast, 1.2), (ImageEnhance.Brightness, 1.1),
+                                     (ImageEnhance.Sharpness, 1.3)),
+    'deblur': lambda img: img.filter(ImageFilter.SHARPEN).filter(ImageFilter.UnsharpMask(radius=2, percent=150)),
+    'denoise': lambda img: img.filter(ImageFilter.MedianFilter(size=3)),
+    'enhance': lambda img: _enhance(img, (ImageEnhance.Color, 1.2), (ImageEnhance.Sharpness, 1.5)),
+    'brightness': lambda img: _enhance(img, (ImageEnhance.Brightness, 1.3)),
+    'contrast': lambda img: _enhance(img, (ImageEnhance.Contrast, 1.3)),
+    'saturation': lambda img: _enhance(img, (ImageEnhance.Color, 1.3)),
+    'grayscale': lambda img: img.convert('L').convert('RGB'),
+    'sepia': _legacy_sepia,
+    'invert': lambda img: Image.eval(img, lambda x: 255 - x),
+    'blur-bg': lambda img: img.filter(ImageFilter.GaussianBlur(radius=10)),
+    'sharpen': lambda img: img.filter(ImageFilter.SHARPEN),
+}
+# Per-pixel Python loops: only timed up to --legacy-max-megapixels
+SLOW_LEGACY_TOOLS = {'sepia'}
+
+
+def bench_tools(args):
+    """Per-tool wall time of the tool engine vs the legacy PIL code, and the largest pixel difference"""
+    params = {'value': 30}
+    print(f"{'tool':<12} {'MP':>5} {'engine_ms':>10} {'legacy_ms':>10} {'speedup':>8} {'max_diff':>9}")
+    for tool in args.tools:
+        for mp in args.megapixels:
+            image = synthetic_image(mp)
+            engine_s, buffer = _timed(
+                lambda: apply_tool_to_buffer(ImageBuffer.from_image(image), tool, params), args.repeats)
+            engine_out = buffer.to_image()
+            if tool in SLOW_LEGACY_TOOLS and mp > args.legacy_max_megapixels:
+                print(f"{tool:<12} {mp:5.1f} {engine_s * 1000:10.1f} {'-':>10} {'-':>8} {'-':>9}")
+                continue
+            legacy_s, legacy_out = _timed(lambda: LEGACY_TOOLS[tool](image), 1 if tool in SLOW_LEGACY_TOOLS else args.repeats)
+            max_diff = int(np.abs(np.asarray(engine_out, dtype=np.int16) -
+                                  np.asarray(legacy_out.convert('RGB'), dtype=np.int16)).max())
+            print(f"{tool:<12} {mp:5.1f} {engine_s * 1000:10.1f} {legacy_s * 1000:10.1f} "
+                  f"{legacy_s / engine_s:7.1f}x {max_diff:9d}")
+
+
+CHAINS = {
+    'default': [
+        {'tool': 'brightness', 'params': {'value': 10}},
+        {'tool': 'contrast', 'params': {'value': 20}},
+        {'tool': 'saturation', 'params': {'value': 15}},
+        {'tool': 'contrast', 'params': {'value': -5}},
+        {'tool': 'sharpen'},
+    ],
+    # Boosted saturation leaves 0-255 before sepia: the matrices must not be folded together
+    'saturate-sepia': [
+        {'tool': 'saturation', 'params': {'value': 30}},
+        {'tool': 'sepia'},
+    ],
+}
+
+
+def _save_and_preview(img, path):
+    """What each /process call pays after the tool: full-resolution save plus the PNG preview"""
+    img.save(path)
+    preview = io.BytesIO()
+    img.save(preview, format='PNG')
+    return preview.getvalue()
+
+
+def bench_chain(args):
+    """Each chain of adjustments as separate /process cycles vs one folded /process-chain pass"""
+    for name in args.chains:
+        _bench_one_chain(name, CHAINS[name], args)
+
+
+def _bench_one_chain(name, chain, args):
+    steps = chain_steps(chain)
+    print(f"chain {name}: {[entry['tool'] for entry in chain]} -> {len(steps)} steps, "
+          f"{len(fold_steps(steps))} folded passes")
+    print(f"{'MP':>5} {'per_call_ms':>12} {'chain_unfolded_ms':>18} {'chain_ms':>9} {'speedup':>8} {'max_diff':>9}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for mp in args.megapixels:
+            source = os.path.join(workdir, 'input.jpg')
+            output = os.path.join(workdir, 'output.jpg')
+            synthetic_image(mp).save(source, quality=95)
+
+            def per_call():
+                # Every adjustment: decode the previous result, apply one tool, save, preview
+                path = source
+                for entry in chain:
+                    buffer = apply_tool_to_buffer(ImageBuffer.from_image(Image.open(path)), entry['tool'],
+                                                  entry.get('params'))
+                    _save_and_preview(buffer.to_image(), output)
+                    path = output
+                return Image.open(output).convert('RGB')
+
+            def one_pass(fold):
+                buffer = apply_chain_to_buffer(ImageBuffer.from_image(Image.open(source)), chain, fold)
+                _save_and_preview(buffer.to_image(), output)
+                return buffer.to_image()
+
+            per_call_s, _ = _timed(per_call, args.repeats)
+            unfolded_s, unfolded = _timed(lambda: one_pass(False), args.repeats)
+            chain_s, folded = _timed(lambda: one_pass(True), args.repeats)
+            # Folding error alone: the same chain with and without folded tables / matrices
+            max_diff = int(np.abs(np.asarray(folded, dtype=np.int16) - np.asarray(unfolded, dtype=np.int16)).max())
+            print(f"{mp:5.1f} {per_call_s * 1000:12.1f} {unfolded_s * 1000:18.1f} {chain_s * 1000:9.1f} "
+                  f"{per_call_s / chain_s:7.1f}x {max_diff:9d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    tools_parser = subparsers.add_parser('tools', help='per-tool time: tool engine vs legacy PIL code')
+    tools_parser.add_argument('--tools', nargs='+', default=sorted(TOOLS), choices=sorted(TOOLS))
+    tools_parser.add_argument('--megapixels', type=float, nargs='+', default=DEFAULT_MEGAPIXELS)
+    tools_parser.add_argument('--legacy-max-megapixels', type=float, default=1,
+                              help='largest size the per-pixel legacy loops (sepia) are timed at')
+    tools_parser.add_argument('--repeats', type=int, default=3)
+    tools_parser.set_defaults(func=bench_tools)
+
+    chain_parser = subparsers.add_parser('chain', help='separate /process cycles vs one folded chain pass')
+    chain_parser.add_argument('--chains', nargs='+', default=sorted(CHAINS), choices=sorted(CHAINS))
+    chain_parser.add_argument('--megapixels', type=float, nargs='+', default=DEFAULT_MEGAPIXELS)
+    chain_parser.add_argument('--repeats', type=int, default=3)
+    chain_parser.set_defaults(func=bench_chain)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
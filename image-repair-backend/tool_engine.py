@@ -0,0 +1,365 @@
+"""
+Vectorized Tool Engine for Image Repair
+Every tool is a short list of steps over one shared RGB uint8 buffer: per-channel lookup
+tables (brightness, contrast, invert), 3x3 color matrices (saturation, grayscale, sepia) or
+OpenCV filters (sharpen, denoise, blur). Results stay within a few levels of the PIL
+ImageEnhance / ImageFilter tools they replace (3x3 kernels leave the 1-pixel border unfiltered,
+as PIL does); UnsharpMask differs most, as OpenCV blurs with a true Gaussian where PIL
+approximates it. The alpha channel, if any, is carried through untouched.
+Adjacent table steps are folded into one table and adjacent matrices into one matrix, so a
+chain of tools touches each pixel once per run of point operations.
+"""
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# ITU-R 601-2 luma weights, as PIL's convert('L')
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+SEPIA_MATRIX = np.array([
+    [0.393, 0.769, 0.189],
+    [0.349, 0.686, 0.168],
+    [0.272, 0.534, 0.131],
+], dtype=np.float32)
+# ImageFilter.SMOOTH (ImageEnhance.Sharpness degenerate) and ImageFilter.SHARPEN kernels
+SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13.0
+SHARPEN_KERNEL = np.array([[-2, -2, -2], [-2, 32, -2], [-2, -2, -2]], dtype=np.float32) / 16.0
+
+_IDENTITY_LUT = np.arange(256, dtype=np.float32)
+
+
+class ImageBuffer:
+    """
+    HxWx3 uint8 RGB working buffer plus the untouched alpha channel (or None).
+    Steps may write into rgb in place: the buffer owns it (copied when not writable).
+    """
+
+    def __init__(self, rgb, alpha=None):
+        self.rgb = np.require(rgb, dtype=np.uint8, requirements=['C', 'W'])
+        self.alpha = alpha
+
+    @classmethod
+    def from_image(cls, img):
+        if img.mode == 'P' and 'transparency' in img.info:
+            img = img.convert('RGBA')
+        if img.mode in ('RGBA', 'LA'):
+            img = img.convert('RGBA')
+            arr = np.asarray(img)
+            return cls(arr[:, :, :3], arr[:, :, 3].copy())
+        return cls(np.asarray(img if img.mode == 'RGB' else img.convert('RGB')))
+
+    def to_image(self):
+        if self.alpha is None:
+            return Image.fromarray(self.rgb, 'RGB')
+        return Image.fromarray(np.dstack([self.rgb, self.alpha]), 'RGBA')
+
+
+class LutInput:
+    """
+    What a table step may ask about its input: the buffer as it would be after the tables
+    folded before this one (lut), computed from the buffer's channel histograms, not its pixels.
+    """
+
+    def __init__(self, rgb, lut=None, histograms=None):
+        self.rgb = rgb
+        self.lut = lut
+        self._histograms = histograms
+
+    def histograms(self):
+        """3x256 per-channel pixel counts of the buffer (before lut)"""
+        if self._histograms is None:
+            self._histograms = np.stack([
+                cv2.calcHist([self.rgb], [channel], None, [256], [0, 256]).ravel() for channel in range(3)])
+        return self._histograms
+
+    def luma_mean(self):
+        """Mean gray level, rounded like ImageEnhance.Contrast"""
+        if self.lut is None:
+            return luma_mean(self.rgb)
+        histograms = self.histograms()
+        channel_means = histograms @ self.lut.astype(np.float64) / histograms[0].sum()
+        return int(float(LUMA @ channel_means) + 0.5)
+
+    def then(self, lut):
+        """Input of the next table step once `lut` is folded in as well"""
+        folded = lut if self.lut is None else lut[self.lut]
+        return LutInput(self.rgb, folded, self._histograms)
+
+
+# --- Steps: each takes the RGB buffer and returns the new one (in place where OpenCV allows) ---
+
+def lut_step(build, run=None):
+    """
+    Step from build(lut_input) -> 256-entry float table (same for every channel). run, if
+    given, is a faster equivalent of the lookup used when the step isn't folded.
+    """
+    def table(lut_input):
+        return np.clip(np.rint(build(lut_input)), 0, 255).astype(np.uint8)
+
+    if run is None:
+        def run(rgb):
+            return cv2.LUT(rgb, table(LutInput(rgb)), dst=rgb)
+    run.kind = 'lut'
+    run.table = table
+    return run
+
+
+def matrix_step(matrix, run=None):
+    """
+    Step applying a 3x3 color matrix to every pixel (rounded, saturated to 0-255). run, if
+    given, is a faster equivalent used when the step isn't folded.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+
+    if run is None:
+        def run(rgb):
+            return cv2.transform(rgb, matrix)
+    run.kind = 'matrix'
+    run.matrix = matrix
+    return run
+
+
+def filter_step(fn):
+    """Step running a spatial filter fn(rgb) -> rgb"""
+    fn.kind = 'filter'
+    return fn
+
+
+def keep_border(source, filtered):
+    """Copy the 1-pixel border of source back into filtered: PIL's 3x3 kernels leave it unfiltered"""
+    filtered[[0, -1], :] = source[[0, -1], :]
+    filtered[:, [0, -1]] = source[:, [0, -1]]
+    return filtered
+
+
+def luma_mean(rgb):
+    """Mean gray level, rounded like ImageEnhance.Contrast"""
+    return int(cv2.mean(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY))[0] + 0.5)
+
+
+def brightness(factor):
+    """ImageEnhance.Brightness: scale towards black"""
+    return lut_step(lambda lut_input: _IDENTITY_LUT * factor)
+
+
+def contrast(factor):
+    """ImageEnhance.Contrast: scale around the image's mean gray level"""
+    def build(lut_input):
+        mean = lut_input.luma_mean()
+        return mean + (_IDENTITY_LUT - mean) * factor
+    return lut_step(build)
+
+
+def invert():
+    return lut_step(lambda lut_input: 255.0 - _IDENTITY_LUT, run=lambda rgb: np.subtract(255, rgb, out=rgb))
+
+
+def saturation_matrix(factor):
+    """ImageEnhance.Color: blend each pixel with its luma"""
+    return factor * np.eye(3, dtype=np.float32) + (1.0 - factor) * np.tile(LUMA, (3, 1))
+
+
+def saturation(factor):
+    return matrix_step(saturation_matrix(factor))
+
+
+def grayscale():
+    # On its own: one single-channel conversion, broadcast back to RGB
+    def run(rgb):
+        return cv2.cvtColor(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY), cv2.COLOR_GRAY2RGB)
+    return matrix_step(np.tile(LUMA, (3, 1)), run)
+
+
+def sepia():
+    return matrix_step(SEPIA_MATRIX)
+
+
+def sharpness(factor):
+    """ImageEnhance.Sharpness: blend with (factor < 1) or away from (factor > 1) a 3x3 smooth"""
+    def run(rgb):
+        smooth = keep_border(rgb, cv2.filter2D(rgb, -1, SMOOTH_KERNEL, borderType=cv2.BORDER_REPLICATE))
+        return cv2.addWeighted(rgb, factor, smooth, 1.0 - factor, 0.0)
+    return filter_step(run)
+
+
+def sharpen_kernel():
+    """ImageFilter.SHARPEN"""
+    return filter_step(lambda rgb: keep_border(rgb, cv2.filter2D(rgb, -1, SHARPEN_KERNEL,
+                                                                 borderType=cv2.BORDER_REPLICATE)))
+
+
+def unsharp_mask(radius=2, percent=150, threshold=3):
+    """ImageFilter.UnsharpMask: add back percent% of (image - blur) where it exceeds threshold"""
+    def run(rgb):
+        blurred = cv2.GaussianBlur(rgb, (0, 0), radius)
+        diff = rgb.astype(np.int16) - blurred
+        diff[np.abs(diff) < threshold] = 0
+        sharpened = rgb + diff * (percent / 100.0)
+        return np.clip(np.rint(sharpened), 0, 255).astype(np.uint8)
+    return filter_step(run)
+
+
+def median(size=3):
+    """ImageFilter.MedianFilter"""
+    return filter_step(lambda rgb: cv2.medianBlur(rgb, size))
+
+
+def gaussian_blur(radius):
+    """ImageFilter.GaussianBlur (radius is the standard deviation)"""
+    return filter_step(lambda rgb: cv2.GaussianBlur(rgb, (0, 0), radius, borderType=cv2.BORDER_REPLICATE))
+
+
+# --- Tool registry: name -> steps(params) ---
+
+TOOLS = {}
+
+
+def register(name):
+    def decorator(fn):
+        TOOLS[name] = fn
+        return fn
+    return decorator
+
+
+def _percent(params):
+    """Slider tools: params['value'] in percent (-100..100) -> enhance factor"""
+    return 1.0 + float(params.get('value', 0)) / 100.0
+
+
+@register('auto-fix')
+def auto_fix_steps(params):
+    return [contrast(1.2), brightness(1.1), sharpness(1.3)]
+
+
+@register('deblur')
+def deblur_steps(params):
+    return [sharpen_kernel(), unsharp_mask(radius=2, percent=150)]
+
+
+@register('denoise')
+def denoise_steps(params):
+    return [median(3)]
+
+
+@register('enhance')
+def enhance_steps(params):
+    return [saturation(1.2), sharpness(1.5)]
+
+
+@register('brightness')
+def brightness_steps(params):
+    return [brightness(_percent(params))]
+
+
+@register('contrast')
+def contrast_steps(params):
+    return [contrast(_percent(params))]
+
+
+@register('saturation')
+def saturation_steps(params):
+    return [saturation(_percent(params))]
+
+
+@register('grayscale')
+def grayscale_steps(params):
+    return [grayscale()]
+
+
+@register('sepia')
+def sepia_steps(params):
+    return [sepia()]
+
+
+@register('invert')
+def invert_steps(params):
+    return [invert()]
+
+
+@register('blur-bg')
+def blur_bg_steps(params):
+    return [gaussian_blur(10)]
+
+
+@register('sharpen')
+def sharpen_steps(params):
+    return [sharpen_kernel()]
+
+
+def fold_steps(steps):
+    """
+    Fused steps for a step list: each run of table steps becomes one table step (exact - the
+    tables compose as the uint8 lookups would), and runs of matrix steps are multiplied into
+    one matrix as long as the product so far keeps every pixel in 0-255 (see
+    _keeps_range), so only the intermediate rounding is skipped. A matrix that may leave
+    the range (saturation > 0, sepia) ends its product: the next matrix starts a new pass
+    on the clipped result. Filters stay as they are.
+    """
+    fused = []
+    index = 0
+    while index < len(steps):
+        kind = steps[index].kind
+        end = index
+        while end < len(steps) and steps[end].kind == kind:
+            end += 1
+        group = steps[index:end]
+        if kind == 'lut' and len(group) > 1:
+            fused.append(_folded_lut_step(group))
+        elif kind == 'matrix' and len(group) > 1:
+            fused.extend(_folded_matrix_steps(group))
+        else:
+            fused.extend(group)
+        index = end
+    return fused
+
+
+def _keeps_range(matrix):
+    """Whether the matrix maps every 0-255 pixel into 0-255 (no clipping to skip)"""
+    return bool((matrix >= 0).all() and (matrix.sum(axis=1) <= 1.0 + 1e-6).all())
+
+
+def _folded_matrix_steps(group):
+    passes = []  # [steps, their product]
+    for step in group:
+        if passes and _keeps_range(passes[-1][1]):
+            passes[-1][0].append(step)
+            passes[-1][1] = step.matrix @ passes[-1][1]
+        else:
+            passes.append([[step], step.matrix])
+    # A step left on its own keeps its own (possibly faster) run
+    return [steps[0] if len(steps) == 1 else matrix_step(matrix) for steps, matrix in passes]
+
+
+def _folded_lut_step(group):
+    def run(rgb):
+        lut_input = LutInput(rgb)
+        for step in group:
+            lut_input = lut_input.then(step.table(lut_input))
+        return cv2.LUT(rgb, lut_input.lut, dst=rgb)
+    run.kind = 'lut'
+    return run
+
+
+def run_steps(buffer, steps, fold=True):
+    """Run steps on the buffer (folded first unless fold=False); returns the buffer"""
+    for step in fold_steps(steps) if fold else steps:
+        buffer.rgb = step(buffer.rgb)
+    return buffer
+
+
+def apply_tool_to_buffer(buffer, tool, params=None):
+    """Run one registered tool on an ImageBuffer (KeyError for unknown tools)"""
+    return run_steps(buffer, TOOLS[tool](params or {}))
+
+
+def chain_steps(chain):
+    """Steps of an ordered tool chain: [{'tool': name, 'params': {...}}, ...] (KeyError for unknown tools)"""
+    steps = []
+    for entry in chain:
+        steps.extend(TOOLS[entry['tool']](entry.get('params') or {}))
+    return steps
+
+
+def apply_chain_to_buffer(buffer, chain, fold=True):
+    """Run an ordered tool chain on an ImageBuffer in one pass per fused step"""
+    return run_steps(buffer, chain_steps(chain), fold)